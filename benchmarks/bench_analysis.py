@@ -0,0 +1,448 @@
+import gzip
+import io
+import json
+import numpy
+import os
+import pandas
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+import zstandard
+
+from scipy.stats import mstats
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "perf_tools"))
+from perf_tools.analysis import get_raw_data, get_data, get_cached_data, get_summary_statistics
+from perf_tools.analysis import check_are_close, explode_differential_frame, expanding_weighted_median
+from perf_tools.analysis import weighted_quantiles
+from perf_tools.analysis import list_run_files, get_runs_data, get_grouped_summary_statistics, sum_actor_samples
+from perf_tools.analysis import OperationSeries, get_latency_windows, make_latency_plot, plot_latency_stats
+from types import SimpleNamespace
+
+def synthetic_records(rows, actors=1, seed=0):
+    # Mimics the samples a Genny actor writes to FTDC, as exported by
+    # `curator ftdc export json`.
+    rnd = random.Random(seed)
+    state = {a: {"n": 0, "ops": 0, "size": 0, "errors": 0, "dur": 0, "total": 0} for a in range(actors)}
+    ts = 1666000000000
+    for i in range(rows):
+        actor = i % actors
+        s = state[actor]
+        ops = rnd.choice([0, 1, 2, 5, 10, 37])
+        s["n"] += ops
+        s["ops"] += ops
+        s["size"] += ops * 100
+        s["errors"] += rnd.random() < 0.01
+        dur = ops * rnd.randint(1000, 5000000)
+        s["dur"] += dur
+        s["total"] += dur + ops * rnd.randint(10, 1000)
+        ts += rnd.randint(1, 20)
+        yield {
+            "ts": ts,
+            "id": actor,
+            "counters": {"n": s["n"], "ops": s["ops"], "size": s["size"], "errors": s["errors"]},
+            "timers": {"dur": s["dur"], "total": s["total"]},
+            "gauges": {"state": 0, "workers": actors, "failed": 0},
+        }
+
+def write_synthetic_export(path, rows, actors=1, seed=0):
+    with open(path, "w") as fstream:
+        for record in synthetic_records(rows, actors, seed):
+            fstream.write(json.dumps(record) + "\n")
+
+def _bson(doc, dates=()):
+    # A BSON document of int64s (dates for the keys in dates), binaries and
+    # sub-documents
+    body = b""
+    for key, value in doc.items():
+        name = key.encode() + b"\x00"
+        if isinstance(value, dict):
+            body += b"\x03" + name + _bson(value)
+        elif isinstance(value, bytes):
+            body += b"\x05" + name + struct.pack("<iB", len(value), 0) + value
+        elif key in dates:
+            body += b"\x09" + name + struct.pack("<q", value)
+        elif key == "type":
+            body += b"\x10" + name + struct.pack("<i", value)
+        else:
+            body += b"\x12" + name + struct.pack("<q", value)
+    return struct.pack("<i", len(body) + 5) + body + b"\x00"
+
+def _uvarints(tokens):
+    # The unsigned varint encoding of an array of uint64s
+    nbytes = numpy.ones(len(tokens), dtype=numpy.int64)
+    for k in range(1, 10):
+        nbytes += tokens >= numpy.uint64(1 << (7 * k))
+    out = numpy.empty(nbytes.sum(), dtype=numpy.uint8)
+    starts = numpy.cumsum(nbytes) - nbytes
+    for k in range(10):
+        has = nbytes > k
+        byte = (tokens[has] >> numpy.uint64(7 * k)) & numpy.uint64(0x7F)
+        more = (nbytes[has] > k + 1).astype(numpy.uint64) << numpy.uint64(7)
+        out[starts[has] + k] = byte | more
+    return out.tobytes()
+
+def _ftdc_deltas(deltas):
+    # Replaces each run of zeros with a 0 and the number of zeros after it
+    is_zero = deltas == 0
+    run_start = is_zero & ~numpy.concatenate(([False], is_zero[:-1]))
+    run_id = numpy.cumsum(run_start) - 1
+    run_lengths = numpy.bincount(run_id[is_zero]) if is_zero.any() else numpy.empty(0, dtype=numpy.int64)
+    keep = ~is_zero | run_start
+    tokens = deltas[keep]
+    starts = numpy.flatnonzero(run_start[keep])
+    tokens = numpy.insert(tokens, starts + 1, (run_lengths - 1).astype(numpy.uint64))
+    return tokens
+
+def write_synthetic_ftdc(path, rows, actors=1, seed=0, chunk_samples=1000):
+    # Writes the samples of synthetic_records as an FTDC file, the way
+    # Genny's FTDC writer lays them out
+    records = synthetic_records(rows, actors, seed)
+    with open(path, "wb") as fstream:
+        fstream.write(_bson({"_id": 0, "type": 0, "doc": {"version": 1}}, dates=("_id",)))
+        while True:
+            samples = [x for _, x in zip(range(chunk_samples), records)]
+            if not samples:
+                break
+            flat = [[x["ts"], x["id"]] + [v for k in ["counters", "timers", "gauges"] for v in x[k].values()]
+                for x in samples]
+            values = numpy.array(flat, dtype=numpy.int64).T.view(numpy.uint64)
+            deltas = numpy.diff(values, axis=1).ravel()
+            payload = (_bson(samples[0], dates=("ts",)) + struct.pack("<II", *values[:, 1:].shape)
+                + _uvarints(_ftdc_deltas(deltas)))
+            data = struct.pack("<I", len(payload)) + zlib.compress(payload)
+            fstream.write(_bson({"_id": samples[0]["ts"], "type": 1, "data": data}, dates=("_id",)))
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def bench_loader(rows):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "export.json")
+        write_synthetic_export(path, rows)
+        size_mb = os.path.getsize(path) / (1 << 20)
+        raw_data, elapsed = _timed(get_raw_data, path)
+        print(f"get_raw_data: {len(raw_data)} rows ({size_mb:.1f} MiB) in {elapsed:.3f}s, "
+              f"{len(raw_data) / elapsed:,.0f} rows/sec")
+        metric_data, elapsed = _timed(get_data, path)
+        print(f"get_data:     {len(metric_data.fixed_data)} rows ({size_mb:.1f} MiB) in {elapsed:.3f}s, "
+              f"{len(metric_data.fixed_data) / elapsed:,.0f} rows/sec")
+
+def bench_cache(rows):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "export.json")
+        write_synthetic_export(path, rows)
+        _, elapsed = _timed(get_data, path)
+        print(f"get_data:                 {elapsed:.3f}s")
+        _, elapsed = _timed(get_cached_data, path)
+        print(f"get_cached_data (build):  {elapsed:.3f}s")
+        _, elapsed = _timed(get_cached_data, path)
+        print(f"get_cached_data (cached): {elapsed:.3f}s")
+
+def baseline_summary_statistics(b, fixed_data, raw_data):
+    # get_summary_statistics as it was before the weighted frame, frozen as
+    # the reference: scipy's mquantiles and pandas' mean/max/min over the
+    # per-operation frame b
+    latencies = b["pure_latency"].to_numpy()
+    quantiles = mstats.mquantiles(latencies, prob=[0.5,0.8,0.9,0.95,0.99], alphap=1/3, betap=1/3)
+    duration = (b["ts"].iloc[-1] - b["ts"].iloc[0]).total_seconds()
+    ops = fixed_data["d(ops)"].sum()
+    size = fixed_data["d(size)"].sum()
+    docs = fixed_data["d(n)"].sum()
+    errs = fixed_data["d(err)"].sum()
+    return {
+        'AverageLatency': latencies.mean(),
+        'AverageSize': size / ops,
+        'OperationThroughput': ops / duration,
+        'DocumentThroughput': docs / duration,
+        'SizeThroughput': size / duration,
+        'ErrorRate': errs / duration,
+        'Latency50thPercentile': quantiles[0],
+        'Latency80thPercentile': quantiles[1],
+        'Latency90thPercentile': quantiles[2],
+        'Latency95thPercentile': quantiles[3],
+        'Latency99thPercentile': quantiles[4],
+        'WorkersMin': raw_data["gauges.workers"].min(),
+        'WorkersMax': raw_data["gauges.workers"].max(),
+        'LatencyMax': latencies.max(),
+        'LatencyMin': latencies.min(),
+        'DurationTotal': duration * 1e9,
+        'ErrorsTotal': errs,
+        'OperationsTotal': ops,
+        'DocumentsTotal': docs,
+        'SizeTotal': size,
+        'OverheadTotal': fixed_data["d(t_overhead)"].sum()
+    }
+
+def bench_weighted(rows):
+    # Compares the weighted differential frame with the per-operation one it
+    # replaces: both must give the same summary statistics.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "export.json")
+        write_synthetic_export(path, rows)
+        weighted, elapsed = _timed(get_data, path)
+        print(f"weighted: {len(weighted.diff_data)} rows, "
+              f"{weighted.diff_data.memory_usage().sum() / (1 << 20):.1f} MiB in {elapsed:.3f}s")
+        exploded, elapsed = _timed(get_data, path, True)
+        print(f"exploded: {len(exploded.diff_data)} rows, "
+              f"{exploded.diff_data.memory_usage().sum() / (1 << 20):.1f} MiB in {elapsed:.3f}s")
+
+        weighted_stats, elapsed = _timed(get_summary_statistics, weighted.diff_data, weighted.fixed_data, weighted.raw_data)
+        print(f"get_summary_statistics (weighted): {elapsed:.3f}s")
+        exploded_stats, elapsed = _timed(get_summary_statistics, exploded.diff_data, exploded.fixed_data, exploded.raw_data)
+        print(f"get_summary_statistics (exploded): {elapsed:.3f}s")
+        if not check_are_close(exploded_stats, weighted_stats):
+            raise Exception(f"Weighted summary statistics differ: {weighted_stats} != {exploded_stats}")
+        # Both of the above go through the weighted quantiles, so check them
+        # against mquantiles too
+        baseline_stats, elapsed = _timed(baseline_summary_statistics, exploded.diff_data, exploded.fixed_data,
+            exploded.raw_data)
+        print(f"baseline (mquantiles, exploded): {elapsed:.3f}s")
+        if not check_are_close(baseline_stats, weighted_stats):
+            raise Exception(f"Weighted summary statistics differ from the baseline: {weighted_stats} != {baseline_stats}")
+        # Operations of a row share its latency, so the percentiles above
+        # rarely fall between two latencies. Distinct latencies with small
+        # weights test the interpolation as well.
+        rnd = numpy.random.default_rng(0)
+        probs = [0.01, 0.25, 0.5, 0.8, 0.9, 0.95, 0.99]
+        for n in [1, 2, 7, 50, 1000]:
+            values = rnd.lognormal(13, 1, n)
+            weights = rnd.integers(1, 5, n)
+            expected = mstats.mquantiles(numpy.repeat(values, weights), prob=probs, alphap=1/3, betap=1/3)
+            calculated = weighted_quantiles(values, weights, probs, alphap=1/3, betap=1/3)
+            if not check_are_close(dict(zip(probs, expected)), dict(zip(probs, calculated))):
+                raise Exception(f"Weighted quantiles of {n} values differ from mquantiles: {calculated} != {expected}")
+        if not explode_differential_frame(weighted.diff_data).equals(exploded.diff_data):
+            raise Exception(f"Exploding the weighted frame doesn't give the per-operation frame")
+        print(f"weighted and exploded results match")
+
+def bench_median(op_counts):
+    # Running median of pure latency: pandas over the per-operation rows
+    # versus the weighted engine over the per-sample rows.
+    rng = numpy.random.default_rng(0)
+    for ops in op_counts:
+        weights = rng.integers(1, 20, size=max(ops // 10, 1))
+        weights = weights[:numpy.searchsorted(numpy.cumsum(weights), ops) + 1]
+        latencies = rng.lognormal(14, 1, size=len(weights))
+
+        weighted, weighted_elapsed = _timed(expanding_weighted_median, latencies, weights)
+        exploded = pandas.Series(numpy.repeat(latencies, weights))
+        expected, pandas_elapsed = _timed(lambda: exploded.expanding().median().to_numpy())
+        if not numpy.allclose(weighted, expected[numpy.cumsum(weights) - 1]):
+            raise Exception(f"Running medians differ for {ops} ops")
+        print(f"{weights.sum():>10} ops / {len(weights):>9} samples: pandas {pandas_elapsed:.3f}s, "
+              f"weighted {weighted_elapsed:.3f}s")
+
+def bench_ftdc(rows):
+    # Decoding FTDC in-process versus parsing curator's JSON export of it.
+    # The export itself isn't timed, as it needs curator: see ftdc_file.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ftdc_path = os.path.join(tmpdir, "Actor.Operation")
+        json_path = ftdc_path + ".json"
+        write_synthetic_ftdc(ftdc_path, rows)
+        write_synthetic_export(json_path, rows)
+        print(f"FTDC {os.path.getsize(ftdc_path) / (1 << 20):.1f} MiB, JSON export "
+              f"{os.path.getsize(json_path) / (1 << 20):.1f} MiB")
+        from_json, elapsed = _timed(get_raw_data, json_path)
+        print(f"get_raw_data (JSON): {elapsed:.3f}s, {rows / elapsed:,.0f} rows/sec")
+        from_ftdc, elapsed = _timed(get_raw_data, ftdc_path)
+        print(f"get_raw_data (FTDC): {elapsed:.3f}s, {rows / elapsed:,.0f} rows/sec")
+        if not from_ftdc.equals(from_json):
+            raise Exception(f"Decoded FTDC differs from the JSON export")
+        print(f"FTDC and JSON frames match")
+
+def bench_ftdc_file(ftdc_path, curator=None):
+    # Decoding a real Genny FTDC artifact, and, given curator, exporting it
+    # to JSON and parsing that as well
+    from_ftdc, elapsed = _timed(get_raw_data, ftdc_path)
+    print(f"get_raw_data (FTDC): {len(from_ftdc)} rows in {elapsed:.3f}s")
+    if curator is None:
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        json_path = os.path.join(tmpdir, "export.json")
+        def export():
+            with open(json_path, "w") as fstream:
+                subprocess.run([curator, "ftdc", "export", "json", "--input", ftdc_path], stdout=fstream, check=True)
+        _, export_elapsed = _timed(export)
+        from_json, elapsed = _timed(get_raw_data, json_path)
+        print(f"curator export:      {export_elapsed:.3f}s, {os.path.getsize(json_path) / (1 << 20):.1f} MiB")
+        print(f"get_raw_data (JSON): {elapsed:.3f}s, {export_elapsed + elapsed:.3f}s in all")
+        if not from_ftdc.equals(from_json):
+            raise Exception(f"Decoded FTDC differs from curator's export")
+        print(f"FTDC and JSON frames match")
+
+def bench_compressed(rows):
+    # Loading an export compressed the way conversion_compression writes it,
+    # versus loading it uncompressed
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "export.json")
+        write_synthetic_export(path, rows)
+        with open(path, "rb") as fstream:
+            text = fstream.read()
+        def write_gzip():
+            with gzip.open(path + ".gz", "wb", compresslevel=1) as fstream:
+                fstream.write(text)
+        def write_zstd():
+            with open(path + ".zst", "wb") as fstream:
+                fstream.write(zstandard.ZstdCompressor(level=3).compress(text))
+        _, gzip_elapsed = _timed(write_gzip)
+        _, zstd_elapsed = _timed(write_zstd)
+        expected = None
+        for suffix, elapsed in [("", 0), (".gz", gzip_elapsed), (".zst", zstd_elapsed)]:
+            raw_data, load_elapsed = _timed(get_raw_data, path + suffix)
+            print(f"export.json{suffix:4} {os.path.getsize(path + suffix) / (1 << 20):7.1f} MiB, "
+                  f"compressed in {elapsed:.3f}s, get_raw_data {load_elapsed:.3f}s")
+            if expected is None:
+                expected = raw_data
+            elif not raw_data.equals(expected):
+                raise Exception(f"Loading export.json{suffix} gives different data")
+
+def bench_actors(rows, actors):
+    # Per-actor differencing of a multi-threaded workload's interleaved
+    # samples, versus splitting the samples by actor and differencing each
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "Actor.Operation")
+        write_synthetic_ftdc(path, rows, actors)
+        raw_data = get_raw_data(path)
+        metric_data, elapsed = _timed(get_data, path)
+        fixed_data = metric_data.fixed_data
+        print(f"get_data: {rows} rows of {actors} actors in {elapsed:.3f}s")
+        def split_by_actor():
+            return {actor: raw_data[raw_data["id"] == actor]["counters.ops"].diff().fillna(0)
+                for actor in raw_data["id"].unique()}
+        _, elapsed = _timed(split_by_actor)
+        print(f"differencing ops by actor in a loop: {elapsed:.3f}s")
+        summed, elapsed = _timed(sum_actor_samples, fixed_data, "1s")
+        print(f"sum_actor_samples: {len(summed)} 1s intervals in {elapsed:.3f}s")
+        whole_stream = numpy.diff(raw_data["counters.ops"].to_numpy(), prepend=0)
+        print(f"Negative ops deltas: {(whole_stream < 0).sum()} differencing the whole stream, "
+              f"{(fixed_data['d(ops)'] < 0).sum()} differencing by actor")
+        final_ops = raw_data.groupby("id")["counters.ops"].last()
+        if not fixed_data.groupby("actor_id")["d(ops)"].sum().equals(final_ops):
+            raise Exception(f"Actor deltas don't add up to the actors' counters")
+        if summed["d(ops)"].sum() != final_ops.sum():
+            raise Exception(f"Summed deltas don't add up to the actors' counters")
+        print(f"Actor deltas add up to the actors' counters")
+
+def _render():
+    from matplotlib import pyplot as plt
+    plt.savefig(io.BytesIO(), format="png")
+    plt.close("all")
+
+def bench_plots(rows):
+    # Plotting the latency of a run from its rollups, versus computing the
+    # moving averages over every operation of the exploded frame
+    import matplotlib
+    matplotlib.use("Agg")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "Actor.Operation")
+        write_synthetic_ftdc(path, rows)
+        b = get_data(path).diff_data
+        def per_operation():
+            latencies = explode_differential_frame(b)["pure_latency(ms)"]
+            return latencies.ewm(alpha=0.02).mean().to_numpy(), latencies.rolling(1024).mean().to_numpy()
+        (ewm, rolling), elapsed = _timed(per_operation)
+        print(f"exploded moving averages:  {len(ewm)} operations in {elapsed:.3f}s")
+        series, elapsed = _timed(OperationSeries, b)
+        print(f"OperationSeries:           {len(series)} operations in {elapsed:.3f}s")
+        ops = numpy.linspace(0, len(series) - 1, 100000).astype(numpy.int64)
+        if not (numpy.allclose(series.ewm_mean(ops), ewm[ops])
+                and numpy.allclose(series.rolling_mean(ops), rolling[ops], equal_nan=True)):
+            raise Exception(f"OperationSeries moving averages differ from the exploded frame's")
+        _, elapsed = _timed(lambda: (plot_latency_stats(series, "total_ops", regr="log"), _render()))
+        print(f"plot_latency_stats:        whole run rendered in {elapsed:.3f}s")
+        windows, elapsed = _timed(get_latency_windows, b, "1s", "pure_latency(ms)")
+        print(f"get_latency_windows:       {len(windows)} 1s windows in {elapsed:.3f}s")
+        _, elapsed = _timed(lambda: (make_latency_plot(windows, "1s", "pure_latency(ms)"), _render()))
+        print(f"make_latency_plot:         rendered in {elapsed:.3f}s")
+
+def write_synthetic_runs(workdir, runs, rows):
+    # Lays out FTDC files for runs executions of two tests the way
+    # fetch_ftdc_files does, and returns a stand-in for their WorkloadConfig
+    tests = ["Actor.Reads", "Actor.Writes"]
+    executions = []
+    for i in range((runs + len(tests) - 1) // len(tests)):
+        execution = SimpleNamespace(version_id="patch", build_variant=f"variant-{i % 3}",
+            display_name=f"task-{i // 3}", execution=0)
+        dirpath = os.path.join(workdir, "workload", "patch", execution.build_variant, execution.display_name, "0")
+        os.makedirs(dirpath)
+        for j, test in enumerate(tests):
+            write_synthetic_ftdc(os.path.join(dirpath, test), rows, actors=4, seed=i * len(tests) + j)
+        executions.append(execution)
+    return SimpleNamespace(workload_name="workload", genny_metrics=SimpleNamespace(tests=tests),
+        all_executions=lambda: executions)
+
+def bench_runs(runs, rows):
+    # Loading every run and summarizing it one call at a time, as the
+    # notebooks do, versus get_runs_data and get_grouped_summary_statistics
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workload = write_synthetic_runs(tmpdir, runs, rows)
+        run_files = list_run_files(workload, tmpdir)
+        def one_at_a_time():
+            stats = []
+            for _, path in run_files:
+                metric_data = get_data(path)
+                stats.append(get_summary_statistics(metric_data.diff_data, metric_data.fixed_data,
+                    metric_data.raw_data))
+            return stats
+        expected, elapsed = _timed(one_at_a_time)
+        print(f"get_data + get_summary_statistics per run: {len(run_files)} runs in {elapsed:.3f}s")
+        data, load_elapsed = _timed(get_runs_data, workload, tmpdir)
+        summary, elapsed = _timed(get_grouped_summary_statistics, data)
+        print(f"get_runs_data:                  {len(data)} rows in {load_elapsed:.3f}s")
+        print(f"get_grouped_summary_statistics: {len(summary)} runs in {elapsed:.3f}s")
+        for (key, _), stats in zip(run_files, expected):
+            if not check_are_close(stats, summary.loc[key].to_dict()):
+                raise Exception(f"Summary statistics of {key} differ")
+        print(f"Summary statistics match")
+
+def usage():
+    print(f"Usage: bench_analysis.py <BENCHMARK> [ARGS]\n")
+    print(f"Benchmarks:")
+    print(f"  loader [ROWS]     time loading a synthetic FTDC JSON export (default 1000000 rows)")
+    print(f"  cache [ROWS]      time building and reopening the columnar cache of an export")
+    print(f"  weighted [ROWS]   compare the weighted and per-operation differential frames")
+    print(f"  median [OPS...]   time the running median of latency (default 1e5 1e6 1e7 ops)")
+    print(f"  compressed [ROWS] compare loading gzip and zstd compressed exports with a plain one (default 1000000 rows)")
+    print(f"  ftdc [ROWS]       compare decoding synthetic FTDC with parsing its JSON export (default 1000000 rows)")
+    print(f"  actors [ROWS] [ACTORS] time differencing interleaved actors' samples (default 1000000 rows of 8 actors)")
+    print(f"  plots [ROWS]      time the latency plots of a run, and its moving averages over every operation (default 1000000 rows)")
+    print(f"  runs [RUNS] [ROWS] compare loading and summarizing runs one at a time with get_runs_data (default 24 runs of 100000 rows)")
+    print(f"  ftdc_file FTDC [CURATOR] time decoding a Genny FTDC file, and exporting it with curator and parsing that")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        usage()
+        raise Exception(f"Need a benchmark name")
+
+    cmd = sys.argv[1]
+    if cmd == "loader":
+        bench_loader(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif cmd == "cache":
+        bench_cache(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif cmd == "weighted":
+        bench_weighted(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif cmd == "median":
+        bench_median([int(float(x)) for x in sys.argv[2:]] or [100000, 1000000, 10000000])
+    elif cmd == "compressed":
+        bench_compressed(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif cmd == "ftdc":
+        bench_ftdc(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif cmd == "actors":
+        bench_actors(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000, int(sys.argv[3]) if len(sys.argv) > 3 else 8)
+    elif cmd == "plots":
+        bench_plots(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif cmd == "runs":
+        bench_runs(int(sys.argv[2]) if len(sys.argv) > 2 else 24, int(sys.argv[3]) if len(sys.argv) > 3 else 100000)
+    elif cmd == "ftdc_file":
+        bench_ftdc_file(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        usage()
+        raise Exception(f"Unknown benchmark: {cmd}")
@@ -0,0 +1,281 @@
+import csv
+import http.server
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "perf_tools"))
+from contextlib import redirect_stdout
+from evergreen_cache import ArtifactInfo, ExecutionInfo, TaskInfo, save_version_cache
+from fetch import JSON_STREAM_CHUNK_SIZE, iter_json_array, make_session
+from stats_csv import DEFAULT_STORAGE_METRICS
+from writer import TableWriter
+from ycsb_postprocess import SUMMARY_STATS_METRICS_REGEX, scan_ycsb_log_file
+
+# The egrep invocations the YCSB postprocessors used to run per log
+EGREP_SUMMARY_STATS_REGEX = f"\\[(OVERALL|INSERT|READ|UPDATE)\\], {SUMMARY_STATS_METRICS_REGEX}, [0-9.]+"
+EGREP_WC_REGEX = "WriteConflict.*Please retry your operation"
+
+def write_synthetic_mongod_log(path, size_mb, seed=0):
+    # Mimics a structured mongod.log with occasional WriteConflict retries. A
+    # 64 MiB block of lines is generated once and repeated up to size_mb.
+    rnd = random.Random(seed)
+    lines = []
+    block_size = 0
+    while block_size < min(size_mb, 64) << 20:
+        if rnd.random() < 0.02:
+            line = ('{"t":{"$date":"2022-10-17T12:00:00.000+00:00"},"s":"D1","c":"WRITE","id":22899,'
+                    '"ctx":"conn42","msg":"WriteConflict exception thrown","attr":{"reason":'
+                    '"WriteConflict error: this operation conflicted with another operation. '
+                    'Please retry your operation or multi-document transaction."}}\n')
+        else:
+            line = ('{"t":{"$date":"2022-10-17T12:00:00.000+00:00"},"s":"I","c":"COMMAND","id":51803,'
+                    f'"ctx":"conn{rnd.randint(1, 500)}","msg":"Slow query","attr":{{"type":"command",'
+                    f'"ns":"ycsb.usertable","command":{{"find":"usertable","filter":{{"_id":"user{rnd.getrandbits(40)}"}}}},'
+                    f'"planSummary":["IDHACK"],"keysExamined":1,"docsExamined":1,"durationMillis":{rnd.randint(100, 900)}}}}}\n')
+        lines.append(line)
+        block_size += len(line)
+    block = "".join(lines).encode()
+    with open(path, "wb") as fstream:
+        for _ in range(max((size_mb << 20) // len(block), 1)):
+            fstream.write(block)
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def _egrep_stats(logpath):
+    # The old path: one egrep for the summary stats and one for the
+    # WriteConflict count, each reading the whole file
+    summary = subprocess.run(["egrep", "-o", EGREP_SUMMARY_STATS_REGEX, logpath],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    wc = subprocess.run(["egrep", "-c", EGREP_WC_REGEX, logpath],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    return summary.stdout.splitlines(), int(wc.stdout.strip())
+
+def bench_scan(size_mb, files):
+    # size_mb of logs in total, split across files logs
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = [os.path.join(tmpdir, f"mongod.{i}.log") for i in range(files)]
+        write_synthetic_mongod_log(paths[0], max(size_mb // files, 1))
+        for path in paths[1:]:
+            shutil.copyfile(paths[0], path)
+        size_mb = sum(os.path.getsize(path) for path in paths) / (1 << 20)
+
+        egrepped, elapsed = _timed(lambda: [_egrep_stats(path) for path in paths])
+        print(f"egrep -o + egrep -c: {elapsed:.3f}s, {size_mb / elapsed:,.0f} MiB/sec")
+        scanned, scan_elapsed = _timed(lambda: [scan_ycsb_log_file(path) for path in paths])
+        print(f"scan_ycsb_log_file:  {scan_elapsed:.3f}s, {size_mb / scan_elapsed:,.0f} MiB/sec")
+        for (summary, wc_count), (stats, scanned_wc_count) in zip(egrepped, scanned):
+            if scanned_wc_count != wc_count or len(stats) != len(summary):
+                raise Exception(f"Scan found {scanned_wc_count} WriteConflicts and {len(stats)} stats, "
+                                f"egrep found {wc_count} and {len(summary)}")
+        print(f"{sum(x[1] for x in scanned)} WriteConflict lines in {files} logs, {size_mb:,.0f} MiB, counts match")
+
+def make_rollup_table(rows, seed=0):
+    # A storage stats table as built from cedar rollups, including the Node
+    # column's JSON
+    rnd = random.Random(seed)
+    metrics = ["OperationsTotal", "AverageLatency", "Latency50thPercentile", "Latency95thPercentile",
+        "Latency99thPercentile", "LatencyMax", "ErrorsTotal", "OperationThroughput"]
+    headers = DEFAULT_STORAGE_METRICS + metrics
+    csv_dict = {
+        "Patch ID": [f"6345{i % 7:04x}" for i in range(rows)],
+        "Execution": [i % 3 for i in range(rows)],
+        "Task Name": [f"task_{i % 50}" for i in range(rows)],
+        "Topology": ["linux-3-node-replSet" for _ in range(rows)],
+        "Test": [f"Test{i % 11}" for i in range(rows)],
+        "Node": [json.dumps({"node": f"mongod.{i % 3}", "port": 27017}) for i in range(rows)],
+    }
+    for metric in metrics:
+        csv_dict[metric] = [rnd.random() * 1000 if rnd.random() > 0.01 else None for _ in range(rows)]
+    # Counts are whole numbers, stored as floats like the other rollups
+    for metric in ["OperationsTotal", "ErrorsTotal"]:
+        csv_dict[metric] = [v and float(int(v * 1000)) for v in csv_dict[metric]]
+    return csv_dict, headers
+
+def _legacy_print_csv(csv_dict, headers):
+    # The per-row print() loop the writer replaces
+    for index in range(0, len(csv_dict[headers[0]])):
+        counts=[]
+        for hdr in headers:
+            value = csv_dict[hdr][index]
+            counts.append(str(value) if value is not None else "")
+        print(",".join(counts))
+
+def bench_writer(rows):
+    csv_dict, headers = make_rollup_table(rows)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "legacy.csv")
+        def legacy():
+            with open(path, "w") as fstream:
+                with redirect_stdout(fstream):
+                    print(",".join(headers))
+                    _legacy_print_csv(csv_dict, headers)
+        _, legacy_elapsed = _timed(legacy)
+        print(f"print() per row:     {legacy_elapsed:.3f}s, {os.path.getsize(path) / (1 << 20):.0f} MiB")
+        with open(path, "r") as fstream:
+            widths = set(len(row) for row in csv.reader(fstream))
+        print(f"                     row widths when read back: {sorted(widths)}, expected {len(headers)}")
+
+        expected_path = os.path.join(tmpdir, "expected.csv")
+        with open(expected_path, "w", newline="") as fstream:
+            csv.writer(fstream, lineterminator="\n").writerows(
+                [headers] + [["" if v is None else v for v in row] for row in zip(*(csv_dict[hdr] for hdr in headers))])
+        for format in ["csv", "ndjson", "parquet"]:
+            path = os.path.join(tmpdir, f"table.{format}")
+            def write():
+                with open(path, "wb" if format == "parquet" else "w", **({} if format == "parquet" else {"newline": ""})) as fstream:
+                    writer = TableWriter(fstream, headers, format)
+                    writer.write(csv_dict)
+                    writer.close()
+            _, elapsed = _timed(write)
+            print(f"TableWriter {format + ':':8} {elapsed:.3f}s, {os.path.getsize(path) / (1 << 20):.0f} MiB, "
+                  f"{legacy_elapsed / elapsed:.1f}x the speed of print() per row")
+            if format == "csv":
+                with open(path, "rb") as fstream, open(expected_path, "rb") as expected:
+                    if fstream.read() != expected.read():
+                        raise Exception("TableWriter's CSV differs from csv.writer's")
+                print(f"                     same bytes as csv.writer")
+
+def make_cedar_response(results, tests=20, seed=0):
+    # A /perf/task_id response shaped like Cedar's: one result per test and
+    # run, each with its info, artifacts and rollups
+    rnd = random.Random(seed)
+    metrics = ["OperationsTotal", "AverageLatency", "Latency50thPercentile", "Latency95thPercentile",
+        "Latency99thPercentile", "LatencyMax", "ErrorsTotal", "OperationThroughput"]
+    return json.dumps([{
+        "name": f"{i:024x}",
+        "info": {"project": "sys-perf", "version": "6345aa", "variant": "linux-3-node-replSet",
+            "task_name": "ycsb_60GB", "task_id": "task_1", "execution": 0, "test_name": f"Test{i % tests}",
+            "trial": 0, "parent": "", "tags": None, "args": {"thread_level": i % 64}},
+        "created_at": "2022-10-17T12:00:00.000Z", "completed_at": "2022-10-17T12:30:00.000Z",
+        "artifacts": [{"type": "s3", "bucket": "genny-metrics", "path": f"{i:024x}/ftdc", "format": "ftdc",
+            "download_url": f"https://genny-metrics.s3.amazonaws.com/{i:024x}/ftdc"}],
+        "rollups": {"stats": [{"name": m, "val": rnd.random() * 1000, "version": 3, "user": False}
+            for m in metrics], "processed_at": "2022-10-17T12:31:00.000Z"},
+    } for i in range(results)]).encode()
+
+def _serve_once(body):
+    # Serves body at / from a local server, returning its URL
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+def _timed_peak(func):
+    # Timed untraced, as tracemalloc slows allocations down, then run again
+    # for the peak of the memory allocated
+    result, elapsed = _timed(func)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def bench_cedar(results):
+    # Fetching a Cedar response and keeping only the results of one test
+    body = make_cedar_response(results)
+    server, url = _serve_once(body)
+    session = make_session()
+    def whole():
+        rsp = session.get(url)
+        return [x for x in rsp.json() if x["info"]["test_name"] == "Test0"]
+    def streamed():
+        with session.get(url, stream=True) as rsp:
+            objs = iter_json_array(rsp.iter_content(chunk_size=JSON_STREAM_CHUNK_SIZE))
+            return [x for x in objs if x["info"]["test_name"] == "Test0"]
+    print(f"{results} results, {len(body) / (1 << 20):.0f} MiB response")
+    expected, elapsed, peak = _timed_peak(whole)
+    print(f"rsp.json():      {elapsed:.3f}s, peak {peak / (1 << 20):.0f} MiB")
+    selected, elapsed, peak = _timed_peak(streamed)
+    print(f"iter_json_array: {elapsed:.3f}s, peak {peak / (1 << 20):.0f} MiB")
+    server.shutdown()
+    if selected != expected:
+        raise Exception(f"Streaming kept {len(selected)} results, expected {len(expected)}")
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "perf_tools", "cli.py")
+
+def _write_cached_workload(tmpdir, tasks=20):
+    # An offline config whose patch is served from the Evergreen cache, with
+    # a perf_data.csv and wc_data.csv for each task execution
+    cache_dir = os.path.join(tmpdir, "cache")
+    task_ids = [f"task_{i}" for i in range(tasks)]
+    builds = {"linux-3-node-replSet": {"id": "build_0", "tasks": [[x, x] for x in task_ids]}}
+    task_infos = {x: TaskInfo(x, x, "linux-3-node-replSet", 0, "success",
+        [ExecutionInfo(x, "patch_0", "linux-3-node-replSet", x, 0, "success", [])]) for x in task_ids}
+    save_version_cache(cache_dir, "patch_0", builds, task_infos)
+    for x in task_ids:
+        dirpath = os.path.join(tmpdir, "wl", "patch_0", "linux-3-node-replSet", x, "0")
+        os.makedirs(dirpath)
+        for name in ["perf_data.csv", "wc_data.csv"]:
+            with open(os.path.join(dirpath, name), "w") as fstream:
+                fstream.write("header\n" + "row\n" * 5)
+    cfg = os.path.join(tmpdir, "workload.yml")
+    with open(cfg, "w") as fstream:
+        fstream.write(f"workload_name: {os.path.join(tmpdir, 'wl')}\noffline: true\n"
+            f"evergreen_cache_dir: {cache_dir}\npatches:\n  patch_0:\n    linux-3-node-replSet:\n"
+            + "".join(f"      - {x}\n" for x in task_ids))
+    return cfg
+
+def _best_run_time(args, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_startup(runs):
+    # Wall time of the quick commands, best of runs, next to that of an
+    # interpreter that does nothing
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cfg = _write_cached_workload(tmpdir)
+        baseline = _best_run_time([sys.executable, "-c", "pass"], runs)
+        print(f"python -c pass:          {baseline * 1000:6.1f}ms")
+        for args in [["--help"], ["ycsb_stats", cfg], ["ycsb_wc_stats", cfg]]:
+            elapsed = _best_run_time([sys.executable, CLI_PATH] + args, runs)
+            print(f"cli.py {args[0]:17} {elapsed * 1000:6.1f}ms, {(elapsed - baseline) * 1000:5.1f}ms over python")
+
+def usage():
+    print(f"Usage: bench_postprocess.py <BENCHMARK> [ARGS]\n")
+    print(f"Benchmarks:")
+    print(f"  scan [MiB] [LOGS] compare egrep with the in-process scan of synthetic mongod.logs (default 2048 MiB in 1 log)")
+    print(f"  writer [ROWS]     time writing a rollup table as CSV, NDJSON and Parquet (default 1000000 rows)")
+    print(f"  cedar [RESULTS]   compare parsing a whole Cedar response with streaming it (default 100000 results)")
+    print(f"  startup [RUNS]    time starting the CLI for --help and the local-only commands (default best of 10 runs)")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        usage()
+        raise Exception(f"Need a benchmark name")
+
+    cmd = sys.argv[1]
+    if cmd == "scan":
+        bench_scan(int(sys.argv[2]) if len(sys.argv) > 2 else 2048, int(sys.argv[3]) if len(sys.argv) > 3 else 1)
+    elif cmd == "writer":
+        bench_writer(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif cmd == "startup":
+        bench_startup(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    elif cmd == "cedar":
+        bench_cedar(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+    else:
+        usage()
+        raise Exception(f"Unknown benchmark: {cmd}")
@@ -1,22 +1,22 @@
 # Create some analysis functions
 
-import copy
+# Only what the loaders and the statistics need is imported here: pyarrow and
+# matplotlib are slow to load, so the few functions that use them import them
+# themselves.
+import gzip
+import heapq
+import os
+import shutil
 import pandas
-import warnings
-import requests
-import scipy
-from scipy import stats
-import subprocess
 import numpy as np
-import numpy
-from matplotlib import pyplot as plt
 import json
-import seaborn
+import zstandard
 from collections import namedtuple
+from ftdc import read_ftdc
 
 MetricData = namedtuple("MetricData", ["fixed_data", "diff_data", "raw_data"])
 
-def make_differential_frame(df, dx):
+def _make_sample_frame(df, dx):
     b = pandas.DataFrame()
     b[dx] = df[dx]
     b["d(t_pure)"] = df["d(t_pure)"]
@@ -38,114 +38,769 @@ def make_differential_frame(df, dx):
 
     b["mean_pure_latency"] = df["d(t_pure)"].cumsum() / b["total_ops"]
     b["mean_pure_latency(ms)"] = b["mean_pure_latency"] / 1000000
-    b["median_pure_latency"] = b["pure_latency"].expanding().median()
+    b["median_pure_latency"] = expanding_weighted_median(b["pure_latency"].to_numpy(), b[dx].to_numpy())
     b["median_pure_latency(ms)"] = b["median_pure_latency"] / 1000000
 
     # b["throughput"] = ops / (b["ts"][len(b)-1] - b["ts"][0]).total_seconds()
 
+    return b
+
+def expanding_weighted_median(values, weights):
+    # Running median over all operations seen so far, where values[i] was the
+    # latency of weights[i] operations; the same as expanding().median() on
+    # the per-operation frame, evaluated at the last operation of each sample.
+    # Two heaps split the operations at the median: `lower` (a max-heap, via
+    # negated values) holds at least half of them and `upper` the rest, so
+    # each sample costs O(log n).
+    result = np.full(len(values), np.nan)
+    lower = []
+    upper = []
+    lower_weight = 0
+    upper_weight = 0
+    median = np.nan
+    for i, (value, weight) in enumerate(zip(values.tolist(), weights.tolist())):
+        if weight > 0 and value == value:
+            if lower and value > -lower[0][0]:
+                heapq.heappush(upper, (value, weight))
+                upper_weight += weight
+            else:
+                heapq.heappush(lower, (-value, weight))
+                lower_weight += weight
+
+            # Rebalance so the k-th operation (1-based) is the top of `lower`
+            total = lower_weight + upper_weight
+            k = (total + 1) // 2
+            while lower and lower_weight - lower[0][1] >= k:
+                neg_value, w = heapq.heappop(lower)
+                heapq.heappush(upper, (-neg_value, w))
+                lower_weight -= w
+                upper_weight += w
+            while lower_weight < k:
+                value, w = heapq.heappop(upper)
+                heapq.heappush(lower, (-value, w))
+                lower_weight += w
+                upper_weight -= w
+
+            median = -lower[0][0]
+            if total % 2 == 0 and lower_weight == k:
+                median = (median + upper[0][0]) / 2
+        result[i] = median
+    return result
+
+def explode_differential_frame(b):
     # Have a single row for every sample/increment
-    b = b.loc[b.index.repeat(b[dx])]
+    b = b.loc[b.index.repeat(b["weight"])]
+    b["weight"] = 1
+    return b
 
+def make_differential_frame(df, dx, explode=False):
+    # Each row of the returned frame stands for "weight" (ie. df[dx])
+    # operations that all took the row's latency. Pass explode=True to get one
+    # row per operation instead; memory then scales with the operation count.
+    b = _make_sample_frame(df, dx)
+    b["weight"] = b[dx]
+    if explode:
+        b = explode_differential_frame(b)
     return b
 
-def get_raw_data(jsonFile):
-    data = {
-        "id": [],
-        "counters.n": [],
-        "counters.ops": [],
-        "counters.size": [],
-        "counters.errors": [],
-        "timers.dur": [],
-        "timers.total": [],
-        "gauges.state": [],
-        "gauges.workers": [],
-        "gauges.failed": [],
-        "ts":[]
-    }
-    with open(jsonFile) as f:
-        for line in f:
-            loaded = json.loads(line)
-            data["id"].append(loaded["id"])
-            data["counters.n"].append(loaded["counters"]["n"])
-            data["counters.ops"].append(loaded["counters"]["ops"])
-            data["counters.size"].append(loaded["counters"]["size"])
-            data["counters.errors"].append(loaded["counters"]["errors"])
-            data["timers.dur"].append(loaded["timers"]["dur"])
-            data["timers.total"].append(loaded["timers"]["total"])
-            data["gauges.state"].append(loaded["gauges"]["state"])
-            data["gauges.workers"].append(loaded["gauges"]["workers"])
-            data["gauges.failed"].append(loaded["gauges"]["failed"])
-            data["ts"].append(loaded["ts"])
-    return pandas.DataFrame(data)
-
-def get_data(jsonFile):
-    raw_data = get_raw_data(jsonFile)
-    new_row = pandas.DataFrame({
-        "id": 0,
-        "counters.n": 0,
-        "counters.ops": 0,
-        "counters.size": 0,
-        "counters.errors": 0,
-        "timers.dur": 0,
-        "timers.total": 0,
-        "gauges.state": 0,
-        "gauges.workers": 0,
-        "gauges.failed": 0,
-    }, index=[-1])
-    intermediate = pandas.concat([new_row, raw_data])
-    intermediate
-
-    fixed_data = pandas.DataFrame()
-    fixed_data["actor_id"] = intermediate["id"]
-    fixed_data["d(n)"] = intermediate["counters.n"].diff()
-    fixed_data["d(ops)"] = intermediate["counters.ops"].diff()
-    fixed_data["d(size)"] = intermediate["counters.size"].diff()
-    fixed_data["d(err)"] = intermediate["counters.errors"].diff()
-    fixed_data["d(t_pure)"] = intermediate["timers.dur"].diff()
-    fixed_data["d(t_total)"] = intermediate["timers.total"].diff()
+def _weights(b):
+    if "weight" in b:
+        return b["weight"].to_numpy()
+    return np.ones(len(b), dtype=np.int64)
+
+def _sorted_weighted_quantiles(values, weights, totals, probs, alphap, betap):
+    # The quantiles of each group, given the values sorted by group and by
+    # value within each group, and each group's total weight
+    cum_weights = np.cumsum(weights, dtype=float)
+    offsets = np.cumsum(totals) - totals
+    last = max(len(values) - 1, 0)
+
+    result = np.full((len(totals), len(probs)), np.nan)
+    for j, p in enumerate(probs):
+        m = alphap + p * (1. - alphap - betap)
+        aleph = totals * p + m
+        k = np.floor(np.minimum(np.maximum(aleph, 1), totals - 1))
+        gamma = np.clip(aleph - k, 0, 1)
+        # The k-th and (k+1)-th smallest values of each group (1-based)
+        lo_rank = np.clip(k, 1, totals)
+        hi_rank = np.clip(k + 1, 1, totals)
+        lo = values[np.minimum(np.searchsorted(cum_weights, offsets + lo_rank), last)] if len(values) else 0.
+        hi = values[np.minimum(np.searchsorted(cum_weights, offsets + hi_rank), last)] if len(values) else 0.
+        result[:, j] = np.where(totals > 0, (1. - gamma) * lo + gamma * hi, np.nan)
+    return result
+
+def _grouped_weighted_quantiles(codes, ngroups, values, weights, probs, alphap, betap):
+    # Equivalent to calling scipy.stats.mstats.mquantiles(..., alphap, betap) on
+    # each group's values with every value repeated by its weight. With
+    # alphap=betap=1 this is the linear interpolation used by pandas.
+    order = np.lexsort((values, codes))
+    totals = np.bincount(codes, weights=weights, minlength=ngroups)
+    return _sorted_weighted_quantiles(values[order], weights[order], totals, probs, alphap, betap)
+
+def weighted_quantiles(values, weights, probs, alphap=.4, betap=.4):
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights)
+    codes = np.zeros(len(values), dtype=np.int64)
+    return _grouped_weighted_quantiles(codes, 1, values, weights, probs, alphap, betap)[0]
+
+# Columns of a Genny FTDC sample as exported by `curator ftdc export json`,
+# mapped to their location in each JSON record.
+RAW_DATA_FIELDS = [
+    ("id", ("id",)),
+    ("counters.n", ("counters", "n")),
+    ("counters.ops", ("counters", "ops")),
+    ("counters.size", ("counters", "size")),
+    ("counters.errors", ("counters", "errors")),
+    ("timers.dur", ("timers", "dur")),
+    ("timers.total", ("timers", "total")),
+    ("gauges.state", ("gauges", "state")),
+    ("gauges.workers", ("gauges", "workers")),
+    ("gauges.failed", ("gauges", "failed")),
+    ("ts", ("ts",)),
+]
+RAW_DATA_CHUNK_BYTES = 16 << 20
+
+_DIGITS = b"-0123456789"
+# Maps every byte that can't be part of an integer to a space.
+_NON_DIGITS_TO_SPACE = bytes(c if c in _DIGITS else ord(" ") for c in range(256))
+
+def _flatten_leaves(record, prefix=""):
+    leaves = []
+    for key, value in record.items():
+        if isinstance(value, dict):
+            leaves.extend(_flatten_leaves(value, prefix + key + "."))
+        else:
+            leaves.append((prefix + key, value))
+    return leaves
+
+class _RawDataLayout:
+    # The exporter writes every record with the same keys in the same order,
+    # so once a record is known to hold only integers, a chunk whose lines
+    # all share its non-numeric skeleton can be parsed by splitting out the
+    # numbers rather than by decoding JSON.
+    def __init__(self, line):
+        leaves = _flatten_leaves(json.loads(line))
+        self.fast = all(type(value) is int for _, value in leaves)
+        names = [name for name, _ in leaves]
+        self.width = len(names)
+        self.skeleton = line.strip().translate(None, _DIGITS)
+        self.positions = {}
+        for name, _ in RAW_DATA_FIELDS:
+            if name in names:
+                self.positions[name] = names.index(name)
+            else:
+                self.fast = False
+
+    def parse(self, chunk):
+        nlines = chunk.count(b"\n")
+        if self.fast and chunk.translate(None, _DIGITS + b"\n") == self.skeleton * nlines:
+            numbers = np.array(chunk.translate(_NON_DIGITS_TO_SPACE).split(), dtype=np.int64)
+            if len(numbers) == nlines * self.width:
+                numbers = numbers.reshape(nlines, self.width)
+                return {name: numbers[:, pos].copy() for name, pos in self.positions.items()}
+        return _parse_raw_lines(chunk.splitlines())
+
+def _parse_raw_lines(lines):
+    # Decode the whole batch with a single json.loads call, then pull each
+    # field straight into a typed column: int64 when all of its values are
+    # integers, float64 as soon as one isn't, so none is truncated.
+    lines = [line for line in lines if line.strip()]
+    records = json.loads(b"[" + b",".join(lines) + b"]")
+    columns = {}
+    for name, path in RAW_DATA_FIELDS:
+        if len(path) == 1:
+            values = (r[path[0]] for r in records)
+        else:
+            outer, inner = path
+            values = (r[outer][inner] for r in records)
+        column = np.array(list(values))
+        if column.dtype.kind not in "iuf":
+            raise Exception(f"Non-numeric {name} values in FTDC export lines")
+        columns[name] = column
+    return columns
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def _read_head(path):
+    with open(path, "rb") as f:
+        return f.read(4)
+
+def open_export(jsonFile):
+    # Opens a curator export for reading, decompressing gzip and zstd
+    # exports (as written with conversion_compression) as they're read
+    head = _read_head(jsonFile)
+    if head.startswith(GZIP_MAGIC):
+        return gzip.open(jsonFile, "rb")
+    if head == ZSTD_MAGIC:
+        return zstandard.ZstdDecompressor().stream_reader(open(jsonFile, "rb"), read_across_frames=True, closefd=True)
+    return open(jsonFile, "rb")
+
+def iter_raw_data_chunks(jsonFile, chunk_bytes=RAW_DATA_CHUNK_BYTES):
+    layout = None
+    remainder = b""
+    with open_export(jsonFile) as f:
+        while True:
+            block = f.read(chunk_bytes)
+            if block:
+                data = remainder + block
+                cut = data.rfind(b"\n") + 1
+                chunk, remainder = data[:cut], data[cut:]
+            elif remainder.strip():
+                chunk, remainder = remainder + b"\n", b""
+            else:
+                return
+            if not chunk.strip():
+                continue
+            if layout is None:
+                layout = _RawDataLayout(chunk.lstrip().split(b"\n", 1)[0])
+            yield layout.parse(chunk)
+
+def is_ftdc_file(path):
+    # FTDC files start with the int32 length of a BSON document, whose high
+    # byte is 0 or 1 as documents are at most 16 MiB. An export is text, which
+    # has no such bytes, or compressed, as told by its magic number.
+    head = _read_head(path)
+    return len(head) == 4 and head[3] in (0, 1) and not head.startswith(GZIP_MAGIC)
+
+def get_ftdc_raw_data(ftdcFile):
+    # The same frame as get_raw_data gives for the JSON export of ftdcFile,
+    # decoded from the FTDC file itself
+    columns = read_ftdc(ftdcFile, [name for name, _ in RAW_DATA_FIELDS])
+    return pandas.DataFrame(columns, copy=False)
+
+def get_raw_data(jsonFile, chunk_bytes=RAW_DATA_CHUNK_BYTES):
+    # jsonFile may also be a Genny FTDC file, which is decoded directly
+    if is_ftdc_file(jsonFile):
+        return get_ftdc_raw_data(jsonFile)
+    chunks = {name: [] for name, _ in RAW_DATA_FIELDS}
+    for columns in iter_raw_data_chunks(jsonFile, chunk_bytes):
+        for name, values in columns.items():
+            chunks[name].append(values)
+    data = {}
+    for name, parts in chunks.items():
+        data[name] = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        parts.clear()
+    return pandas.DataFrame(data, copy=False)
+
+def _previous_actor_rows(actor_ids):
+    # The row of the previous sample of each sample's actor, or -1 for an
+    # actor's first sample. The samples of the actors of a multi-threaded
+    # workload are interleaved, each actor with its own counters.
+    order = np.argsort(actor_ids, kind="stable")
+    same_actor = actor_ids[order[1:]] == actor_ids[order[:-1]]
+    previous = np.empty(len(actor_ids), dtype=np.intp)
+    previous[order[:1]] = -1
+    previous[order[1:]] = np.where(same_actor, order[:-1], -1)
+    return previous
+
+def _counter_deltas(counter, previous):
+    # Counters start from zero, so an actor's first sample's delta is its
+    # value.
+    values = counter.to_numpy()
+    return values - np.where(previous >= 0, values[previous], 0)
+
+def _get_fixed_data(raw_data):
+    # The deltas of each sample are from the previous sample of its actor
+    previous = _previous_actor_rows(raw_data["id"].to_numpy())
+    fixed_data = pandas.DataFrame(index=raw_data.index)
+    fixed_data["actor_id"] = raw_data["id"]
+    fixed_data["d(n)"] = _counter_deltas(raw_data["counters.n"], previous)
+    fixed_data["d(ops)"] = _counter_deltas(raw_data["counters.ops"], previous)
+    fixed_data["d(size)"] = _counter_deltas(raw_data["counters.size"], previous)
+    fixed_data["d(err)"] = _counter_deltas(raw_data["counters.errors"], previous)
+    fixed_data["d(t_pure)"] = _counter_deltas(raw_data["timers.dur"], previous)
+    fixed_data["d(t_total)"] = _counter_deltas(raw_data["timers.total"], previous)
     fixed_data["d(t_overhead)"] = fixed_data["d(t_total)"] - fixed_data["d(t_pure)"]
 
-    fixed_data["ts"] = pandas.to_datetime(intermediate["ts"], unit="ms")
-
-    fixed_data = fixed_data.loc[0:]
-    b = make_differential_frame(fixed_data, "d(ops)")
-    return MetricData(fixed_data, b, intermediate.loc[0:])
-
-def get_summary_statistics(b, fixed_data, raw_data):
-    quantiles = stats.mstats.mquantiles(b.loc[:,"pure_latency"].values, prob=[0.5,0.8,0.9,0.95,0.99], alphap=1/3, betap=1/3)
-    averages = b.mean(numeric_only=True)
-    maximum = b.max()
-    minimum = b.min()
-    duration = (b["ts"][len(b)-1] - b["ts"][0]).total_seconds()
-    ops = fixed_data["d(ops)"].sum()
-    size = fixed_data["d(size)"].sum()
-    docs = fixed_data["d(n)"].sum()
-    errs = fixed_data["d(err)"].sum()
-    overhead = fixed_data["d(t_overhead)"].sum()
+    fixed_data["ts"] = pandas.to_datetime(raw_data["ts"], unit="ms")
+    return fixed_data
+
+def sum_actor_samples(fixed_data, interval="1s"):
+    # The deltas of all the actors summed over each interval (a pandas
+    # frequency) of their samples, as a fixed_data frame timestamped by the
+    # intervals' starts, for a workload-wide make_differential_frame. Its
+    # actor_id is -1, standing for all actors.
+    intervals = fixed_data["ts"].dt.floor(interval)
+    columns = [x for x in fixed_data.columns if x.startswith("d(")]
+    summed = fixed_data[columns].groupby(intervals.to_numpy()).sum()
+    summed.insert(0, "actor_id", -1)
+    summed["ts"] = summed.index
+    return summed.reset_index(drop=True)
+
+def get_data(jsonFile, explode=False):
+    raw_data = get_raw_data(jsonFile)
+    fixed_data = _get_fixed_data(raw_data)
+    b = make_differential_frame(fixed_data, "d(ops)", explode)
+    return MetricData(fixed_data, b, raw_data)
+
+# Bump whenever the layout or the meaning of the cached frames changes, so
+# that caches written by older code are rebuilt rather than misread.
+CACHE_VERSION = 4
+CACHE_FRAMES = ["fixed_data", "diff_data", "raw_data"]
+
+def get_cache_dir(jsonFile):
+    return jsonFile + ".cache"
+
+def _cache_stamp(jsonFile):
+    st = os.stat(jsonFile)
+    return {"version": CACHE_VERSION, "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+def _read_cache_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_frame(cache_dir, name, df):
+    # One .npy file per column, named by position since column names such as
+    # "d(ops)" don't make good file names.
+    for i, col in enumerate(df.columns):
+        np.save(os.path.join(cache_dir, f"{name}.{i}.npy"), df[col].to_numpy())
+    return list(df.columns)
+
+def _load_frame(cache_dir, name, columns, mmap):
+    mmap_mode = "r" if mmap else None
+    data = {col: np.load(os.path.join(cache_dir, f"{name}.{i}.npy"), mmap_mode=mmap_mode)
+            for i, col in enumerate(columns)}
+    return pandas.DataFrame(data, copy=False)
+
+def _write_cache(jsonFile, cache_dir):
+    raw_data = get_raw_data(jsonFile)
+    fixed_data = _get_fixed_data(raw_data)
+    frames = {
+        "fixed_data": fixed_data,
+        "diff_data": make_differential_frame(fixed_data, "d(ops)"),
+        "raw_data": raw_data,
+    }
+    meta = _cache_stamp(jsonFile)
+    meta["columns"] = {}
+
+    # Build the cache next to its final location and swap it in at the end,
+    # so an interrupted write never leaves a cache that looks valid.
+    tmp_dir = f"{cache_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in CACHE_FRAMES:
+        meta["columns"][name] = _save_frame(tmp_dir, name, frames[name])
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return meta
+
+def get_cached_data(jsonFile, refresh=False, mmap=True, explode=False):
+    # Same result as get_data(jsonFile), backed by a columnar cache stored in
+    # <jsonFile>.cache. The cache is rebuilt when the source file's size or
+    # mtime changes. With mmap=True the frames are read-only views of the
+    # memory-mapped cache files.
+    cache_dir = get_cache_dir(jsonFile)
+    meta = None if refresh else _read_cache_meta(cache_dir)
+    if meta is None or {k: meta.get(k) for k in ("version", "mtime_ns", "size")} != _cache_stamp(jsonFile):
+        meta = _write_cache(jsonFile, cache_dir)
+
+    frames = {name: _load_frame(cache_dir, name, meta["columns"][name], mmap) for name in CACHE_FRAMES}
+    b = frames["diff_data"]
+    if explode:
+        b = explode_differential_frame(b)
+    return MetricData(frames["fixed_data"], b, frames["raw_data"])
+
+class LatencySketch:
+    # Mergeable latency histogram with logarithmically sized buckets: a value
+    # v > 0 is counted in bucket ceil(log(v) / log(gamma)), where
+    # gamma = (1 + relative_accuracy) / (1 - relative_accuracy).
+    #
+    # Error bounds: quantile(p) is within relative_accuracy (1% by default)
+    # of the exact order statistic of rank floor(p * (count - 1)). The exact
+    # mquantiles-based percentiles interpolate between neighbouring order
+    # statistics, so the two may also differ by the gap between adjacent
+    # ranks. count, sum, min and max are kept exactly.
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _add_buckets(self, keys, counts):
+        keys = np.concatenate([self.keys, keys])
+        counts = np.concatenate([self.counts, counts])
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts, minlength=len(self.keys)).astype(np.int64)
+
+    def add(self, values, weights=None):
+        values = np.asarray(values, dtype=float)
+        weights = np.ones(len(values), dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+        keep = (weights > 0) & ~np.isnan(values)
+        values = values[keep]
+        weights = weights[keep]
+        if len(values) == 0:
+            return self
+
+        positive = values > 0
+        keys = np.ceil(np.log(values[positive]) / np.log(self.gamma)).astype(np.int64)
+        self._add_buckets(keys, weights[positive])
+        self.zero_count += int(weights[~positive].sum())
+        self.count += int(weights.sum())
+        self.sum += float(np.sum(values * weights))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        return self
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise Exception(f"Cannot merge sketches with relative accuracy {self.relative_accuracy} and {other.relative_accuracy}")
+        self._add_buckets(other.keys, other.counts)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.sum / self.count if self.count else np.nan
+
+    def quantiles(self, probs):
+        if not self.count:
+            return np.full(len(probs), np.nan)
+        ranks = np.asarray(probs, dtype=float) * (self.count - 1)
+        cum_counts = self.zero_count + np.cumsum(self.counts)
+        buckets = np.minimum(np.searchsorted(cum_counts, ranks, side="right"), len(self.keys) - 1)
+        estimates = 2 * self.gamma ** self.keys[buckets].astype(float) / (self.gamma + 1) if len(self.keys) else 0.
+        estimates = np.where(ranks < self.zero_count, 0., estimates)
+        return np.clip(estimates, self.min, self.max)
+
+    def quantile(self, p):
+        return self.quantiles([p])[0]
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "keys": self.keys.tolist(),
+            "counts": self.counts.tolist(),
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(d["relative_accuracy"])
+        sketch.keys = np.array(d["keys"], dtype=np.int64)
+        sketch.counts = np.array(d["counts"], dtype=np.int64)
+        sketch.zero_count = d["zero_count"]
+        sketch.count = d["count"]
+        sketch.sum = d["sum"]
+        sketch.min = np.inf if d["min"] is None else d["min"]
+        sketch.max = -np.inf if d["max"] is None else d["max"]
+        return sketch
+
+def merge_latency_sketches(sketches):
+    sketches = list(sketches)
+    merged = LatencySketch(sketches[0].relative_accuracy if sketches else 0.01)
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
+
+def build_latency_sketches(b, measure="pure_latency", relative_accuracy=0.01):
+    # One sketch per actor; merge_latency_sketches(...values()) gives the
+    # sketch of the whole test.
+    weights = _weights(b)
+    values = b[measure].to_numpy(dtype=float)
+    actor_ids = b["actor_id"].to_numpy()
+    sketches = {}
+    for actor_id in np.unique(actor_ids):
+        rows = actor_ids == actor_id
+        sketches[int(actor_id)] = LatencySketch(relative_accuracy).add(values[rows], weights[rows])
+    return sketches
+
+def get_sketch_path(jsonFile):
+    return jsonFile + ".sketch.json"
+
+def get_latency_sketches(jsonFile, refresh=False, relative_accuracy=0.01):
+    # Per-actor pure latency sketches of an FTDC export, serialized to
+    # <jsonFile>.sketch.json and rebuilt when the export changes.
+    path = get_sketch_path(jsonFile)
+    stamp = _cache_stamp(jsonFile)
+    if not refresh and os.path.isfile(path):
+        with open(path) as f:
+            saved = json.load(f)
+        if saved["stamp"] == stamp and saved["relative_accuracy"] == relative_accuracy:
+            return {int(k): LatencySketch.from_dict(v) for k, v in saved["actors"].items()}
+
+    sketches = build_latency_sketches(get_data(jsonFile).diff_data, relative_accuracy=relative_accuracy)
+    saved = {
+        "stamp": stamp,
+        "relative_accuracy": relative_accuracy,
+        "actors": {str(k): v.to_dict() for k, v in sketches.items()},
+    }
+    with open(path + ".tmp", "w") as f:
+        json.dump(saved, f)
+    os.replace(path + ".tmp", path)
+    return sketches
+
+# Columns that partition the tables written by the export command
+EXPORT_PARTITION_COLUMNS = ["Workload", "Patch ID", "Topology"]
+
+def load_exported_table(export_dir, table, filters=None, columns=None):
+    # Loads a table written by `cli.py export` (eg. "ycsb_stats"). filters
+    # are pyarrow predicates such as [("Topology", "==", "linux-standalone")];
+    # partitions and row groups that can't match them aren't read.
+    import pyarrow
+    import pyarrow.dataset
+    partitioning = pyarrow.dataset.partitioning(
+        pyarrow.schema([(x, pyarrow.string()) for x in EXPORT_PARTITION_COLUMNS]), flavor="hive")
+    return pandas.read_parquet(os.path.join(export_dir, table), filters=filters, columns=columns,
+        partitioning=partitioning)
+
+SUMMARY_PERCENTILES = [0.5, 0.8, 0.9, 0.95, 0.99]
+# The columns of fixed_data that are summed over a group's rows
+TOTAL_COLUMNS = ["d(ops)", "d(size)", "d(n)", "d(err)", "d(t_overhead)"]
+
+# The summary statistics below are computed for many groups of rows at once:
+# each row has the code (0 to ngroups - 1) of its group, the rows are put in
+# group order once, and each statistic is then one ufunc.reduceat over the
+# groups' runs of rows.
+def _group_order(codes):
+    # The order that brings the rows of each group together, keeping their
+    # order within the group; None if they already are
+    if len(codes) < 2 or (codes[1:] >= codes[:-1]).all():
+        return None
+    return np.argsort(codes, kind="stable")
+
+def _segments(codes, ngroups):
+    # Where each group's rows start once in group order, and how many there are
+    counts = np.bincount(codes, minlength=ngroups)
+    return np.cumsum(counts) - counts, counts
+
+def _reduce_groups(ufunc, values, starts, counts, empty):
+    # ufunc reduced over each group's values (in group order), or empty for
+    # the groups without rows
+    nonempty = counts > 0
+    result = np.full(len(counts), empty, dtype=np.result_type(values, np.asarray(empty)))
+    if nonempty.any():
+        result[nonempty] = ufunc.reduceat(values, starts[nonempty])
+    return result
+
+def _ts_ns(ts):
+    return ts.to_numpy().astype("datetime64[ns]").view(np.int64)
+
+def _group_latency_statistics(codes, ngroups, latencies, weights, ts):
+    # The latency rollups and the duration of each group of operations:
+    # rows with operations, with their latency, weight (operation count) and
+    # timestamp in ns. A single sort by group and latency serves them all.
+    order = np.lexsort((latencies, codes))
+    starts, counts = _segments(codes, ngroups)
+    latencies = latencies[order]
+    weights = weights[order]
+    rows = np.arange(len(codes))[order]
+    total_weights = _reduce_groups(np.add, weights, starts, counts, 0)
+    nonempty = counts > 0
+    last = np.maximum(starts + counts - 1, 0)
+    lowest = np.where(nonempty, latencies[np.minimum(starts, len(latencies) - 1)], np.nan) if len(latencies) else \
+        np.full(ngroups, np.nan)
+    highest = np.where(nonempty, latencies[last], np.nan) if len(latencies) else np.full(ngroups, np.nan)
+    # The duration runs from the group's first row to its last, in row order
+    first_row = _reduce_groups(np.minimum, rows, starts, counts, 0)
+    last_row = _reduce_groups(np.maximum, rows, starts, counts, 0)
+    duration = np.where(nonempty, (ts[last_row] - ts[first_row]) / 1e9, np.nan) if len(ts) else \
+        np.full(ngroups, np.nan)
+    return {
+        "average": _reduce_groups(np.add, latencies * weights, starts, counts, np.nan) / total_weights,
+        "quantiles": _sorted_weighted_quantiles(latencies, weights, total_weights, SUMMARY_PERCENTILES,
+            1/3, 1/3),
+        "max": highest,
+        "min": lowest,
+        "duration": duration,
+    }
+
+def _group_totals(codes, ngroups, fixed_data, workers):
+    # The TOTAL_COLUMNS sums of each group of fixed_data rows, and the least
+    # and most workers of each group
+    order = _group_order(codes)
+    starts, counts = _segments(codes, ngroups)
+    def grouped(values):
+        values = values.to_numpy()
+        return values if order is None else values[order]
+    totals = {x: _reduce_groups(np.add, grouped(fixed_data[x]), starts, counts, 0) for x in TOTAL_COLUMNS}
+    workers = grouped(workers)
+    totals["workers_min"] = _reduce_groups(np.minimum, workers, starts, counts, np.nan)
+    totals["workers_max"] = _reduce_groups(np.maximum, workers, starts, counts, np.nan)
+    return totals
+
+def _summary_statistics(latency, totals):
+    # The Cedar rollups, from the statistics of a group's operations and the
+    # totals of its rows
+    duration = latency["duration"]
+    quantiles = latency["quantiles"]
+    ops = totals["d(ops)"]
+    size = totals["d(size)"]
+    docs = totals["d(n)"]
+    errs = totals["d(err)"]
     return {
-        'AverageLatency': averages["pure_latency"],
+        'AverageLatency': latency["average"],
         'AverageSize': size / ops,
         'OperationThroughput': ops / duration,
         'DocumentThroughput': docs / duration,
         'SizeThroughput': size / duration,
         'ErrorRate': errs / duration,
-        'Latency50thPercentile': quantiles[0],
-        'Latency80thPercentile': quantiles[1],
-        'Latency90thPercentile': quantiles[2],
-        'Latency95thPercentile': quantiles[3],
-        'Latency99thPercentile': quantiles[4],
-        'WorkersMin': raw_data["gauges.workers"].min(),
-        'WorkersMax': raw_data["gauges.workers"].max(),
-        'LatencyMax': maximum["pure_latency"],
-        'LatencyMin': minimum["pure_latency"],
+        'Latency50thPercentile': quantiles[:, 0],
+        'Latency80thPercentile': quantiles[:, 1],
+        'Latency90thPercentile': quantiles[:, 2],
+        'Latency95thPercentile': quantiles[:, 3],
+        'Latency99thPercentile': quantiles[:, 4],
+        'WorkersMin': totals["workers_min"],
+        'WorkersMax': totals["workers_max"],
+        'LatencyMax': latency["max"],
+        'LatencyMin': latency["min"],
         'DurationTotal': duration * 1e9,
         'ErrorsTotal': errs,
         'OperationsTotal': ops,
         'DocumentsTotal': docs,
         'SizeTotal': size,
-        'OverheadTotal': overhead
+        'OverheadTotal': totals["d(t_overhead)"]
     }
 
+def get_summary_statistics(b, fixed_data, raw_data, sketch=None):
+    # The Cedar rollups of a run, from its frames. With a LatencySketch, the
+    # latency percentiles come from the sketch (see its error bounds) instead
+    # of the exact per-operation latencies.
+    # Rows without operations don't exist in the per-operation view
+    weights = _weights(b)
+    has_ops = weights > 0
+    weights = weights[has_ops]
+    latencies = b["pure_latency"].to_numpy(dtype=float)[has_ops]
+    ts = _ts_ns(b["ts"])[has_ops]
+
+    if sketch is None:
+        latency = _group_latency_statistics(np.zeros(len(latencies), dtype=np.intp), 1, latencies, weights, ts)
+    else:
+        latency = {
+            "average": np.array([sketch.mean()]),
+            "quantiles": np.array([sketch.quantiles(SUMMARY_PERCENTILES)]),
+            "max": np.array([sketch.max]),
+            "min": np.array([sketch.min]),
+            "duration": np.array([(ts[-1] - ts[0]) / 1e9]),
+        }
+    totals = _group_totals(np.zeros(len(fixed_data), dtype=np.intp), 1, fixed_data, raw_data["gauges.workers"])
+    return {name: values[0] for name, values in _summary_statistics(latency, totals).items()}
+
+# The columns that tell the runs in a get_runs_data frame apart, named like
+# the info columns of the Cedar stats tables
+RUN_KEY_COLUMNS = ["Patch ID", "Execution", "Task Name", "Topology", "Test"]
+# The files a run's data is loaded from, in order of preference: the FTDC
+# file decodes fastest, then its JSON exports as ftdc_to_json writes them
+RUN_FILE_SUFFIXES = ["", ".json", ".json.zst", ".json.gz"]
+
+def _run_dir(workdir, workload, execution):
+    # Where genny_postprocess.get_output_dir puts an execution's files
+    return os.path.join(workdir, workload.workload_name, execution.version_id, execution.build_variant,
+        execution.display_name, str(execution.execution))
+
+def list_run_files(workload, workdir=".", tests=None):
+    # The (key, path) of every run of the workload's tests (by default, its
+    # genny_metrics tests) that has been fetched to workdir, where key holds
+    # the RUN_KEY_COLUMNS values. workload is a WorkloadConfig.
+    if tests is None:
+        if workload.genny_metrics is None:
+            raise Exception(f"Must specify a genny_metrics element in config YAML or pass tests to list runs")
+        tests = workload.genny_metrics.tests
+    runs = []
+    for execution in workload.all_executions():
+        dirpath = _run_dir(workdir, workload, execution)
+        for test in tests:
+            paths = [os.path.join(dirpath, test + x) for x in RUN_FILE_SUFFIXES]
+            path = next((x for x in paths if os.path.isfile(x)), None)
+            if path is not None:
+                key = (execution.version_id, execution.execution, execution.display_name, execution.build_variant, test)
+                runs.append((key, path))
+    return runs
+
+def _load_run_frame(path):
+    raw_data = get_raw_data(path)
+    frame = _get_fixed_data(raw_data)
+    frame["workers"] = raw_data["gauges.workers"]
+    return frame
+
+def get_runs_data(workload, workdir=".", tests=None, max_workers=None):
+    # The fixed_data of every run found by list_run_files, plus the workers
+    # gauge, in one frame with a categorical column for each of the
+    # RUN_KEY_COLUMNS. The runs are loaded in up to max_workers processes
+    # (default: the number of CPUs).
+    runs = list_run_files(workload, workdir, tests)
+    if not runs:
+        raise Exception(f"No runs of {workload.workload_name} found in {os.path.abspath(workdir)}")
+    paths = [path for _, path in runs]
+    if max_workers == 1 or len(paths) == 1:
+        frames = [_load_run_frame(x) for x in paths]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers) as pool:
+            frames = list(pool.map(_load_run_frame, paths))
+
+    run_codes = np.repeat(np.arange(len(runs)), [len(x) for x in frames])
+    data = pandas.concat(frames, ignore_index=True)
+    frames.clear()
+    for i, name in enumerate(RUN_KEY_COLUMNS):
+        keys = pandas.Categorical([key[i] for key, _ in runs])
+        data.insert(i, name, pandas.Categorical.from_codes(keys.codes[run_codes], keys.categories))
+    return data
+
+def get_grouped_summary_statistics(data, by=RUN_KEY_COLUMNS):
+    # The get_summary_statistics of every group of the rows of data,
+    # computed for all of them at once. data is a get_runs_data frame, or any
+    # frame with its columns, such as a run's fixed_data with a "workers"
+    # column holding raw_data["gauges.workers"]. by is what data.groupby
+    # takes: column names, such as RUN_KEY_COLUMNS + ["actor_id"] for each
+    # actor of each run, and/or series, such as data["ts"].dt.floor("10s")
+    # for 10 second windows. Returns a frame with a row per group, indexed
+    # like data.groupby(by).sum() but with the groups in order of appearance.
+    by = [by] if isinstance(by, str) else list(by)
+    groups = data.groupby(by, observed=True, sort=False, dropna=False)
+    codes = groups.ngroup().to_numpy()
+    ngroups = groups.ngroups
+    first_rows = np.unique(codes, return_index=True)[1]
+    keys = [data[x] if isinstance(x, str) else pandas.Series(x, index=data.index) for x in by]
+    index = pandas.MultiIndex.from_arrays([x.iloc[first_rows] for x in keys])
+    if len(keys) == 1:
+        index = index.get_level_values(0)
+
+    # Rows without operations don't exist in the per-operation view
+    ops = data["d(ops)"].to_numpy()
+    has_ops = ops > 0
+    weights = ops[has_ops]
+    latencies = data["d(t_pure)"].to_numpy(dtype=float)[has_ops] / weights
+    latency = _group_latency_statistics(codes[has_ops], ngroups, latencies, weights, _ts_ns(data["ts"])[has_ops])
+    totals = _group_totals(codes, ngroups, data, data["workers"])
+    return pandas.DataFrame(_summary_statistics(latency, totals), index=index)
+
+def check_against_cedar_stats(summary, cedar_stats):
+    # Checks get_grouped_summary_statistics(data) (grouped by run) against
+    # the rollups Cedar computed for the same runs: a genny_stats table, as
+    # printed by the genny_stats command or loaded with load_exported_table.
+    # Returns, for each run that Cedar has rollups for, whether check_are_close
+    # finds the statistics they both have close.
+    keys = summary.index.to_frame(index=False)[RUN_KEY_COLUMNS].astype(str)
+    cedar_keys = cedar_stats[RUN_KEY_COLUMNS].astype(str)
+    rows = {tuple(x): i for i, x in enumerate(cedar_keys.itertuples(index=False))}
+    names = [x for x in summary.columns if x in cedar_stats.columns]
+    result = {}
+    for i, key in enumerate(keys.itertuples(index=False)):
+        row = rows.get(tuple(key))
+        if row is None:
+            continue
+        expected = cedar_stats.iloc[row][names].astype(float).dropna().to_dict()
+        result[summary.index[i]] = check_are_close(expected, summary.iloc[i][names].to_dict())
+    return pandas.Series(result, dtype=bool)
+
 def check_are_close(expected, calculated):
     e_arr = []
     c_arr = []
@@ -154,15 +809,57 @@ def check_are_close(expected, calculated):
         c_arr.append(calculated[k])
     return np.allclose(e_arr, c_arr)
 
-def make_latency_plot(df, interval, measure, transition=None, include_outliers=True):
-    grouped_latencies = df.groupby(pandas.Grouper(key="ts", freq=interval))
-    c = pandas.DataFrame()
-    c["median"] = grouped_latencies[measure].median()
-    c["25th"] = grouped_latencies[measure].quantile(0.25)
-    c["75th"] = grouped_latencies[measure].quantile(0.75)
+def get_latency_windows(df, interval, measure, start=None, end=None):
+    # The weighted quartiles, the whiskers (1.5 IQR beyond them) and the
+    # extremes of measure in each interval (a pandas frequency) of the rows
+    # of df with operations, windowed like pandas.Grouper(freq=interval).
+    # Only the rows between the start and end timestamps are read. A single
+    # sort by window and latency serves every statistic.
+    weights = _weights(df)
+    ts = _ts_ns(df["ts"])
+    keep = weights > 0
+    if start is not None:
+        keep &= ts >= pandas.Timestamp(start).value
+    if end is not None:
+        keep &= ts <= pandas.Timestamp(end).value
+    weights = weights[keep]
+    ts = ts[keep]
+    values = df[measure].to_numpy(dtype=float)[keep]
+    if len(ts) == 0:
+        return pandas.DataFrame(columns=["max", "min", "median", "25th", "75th", "IQR", "maximum", "minimum"])
+
+    # Like pandas.Grouper's, the windows are counted from midnight of the
+    # first day, and the first one returned is the first with rows
+    step = pandas.Timedelta(interval).value
+    origin = pandas.Timestamp(ts.min()).floor("D").value
+    codes = (ts - origin) // step
+    first = codes.min()
+    codes -= first
+    ngroups = int(codes.max()) + 1
+    order = np.lexsort((values, codes))
+    starts, counts = _segments(codes, ngroups)
+    values = values[order]
+    weights = weights[order]
+    last = np.maximum(starts + counts - 1, 0)
+    c = pandas.DataFrame(index=pandas.to_datetime(origin + (first + np.arange(ngroups)) * step))
+    c.index.name = "ts"
+    c["max"] = np.where(counts > 0, values[last], np.nan)
+    c["min"] = np.where(counts > 0, values[np.minimum(starts, len(values) - 1)], np.nan)
+    quartiles = _sorted_weighted_quantiles(values, weights, _reduce_groups(np.add, weights, starts, counts, 0),
+        [0.5, 0.25, 0.75], alphap=1, betap=1)
+    c["median"] = quartiles[:, 0]
+    c["25th"] = quartiles[:, 1]
+    c["75th"] = quartiles[:, 2]
     c["IQR"] = c["75th"] - c["25th"]
     c["maximum"] = c["75th"] + 1.5 * c["IQR"]
     c["minimum"] = c["25th"] - 1.5 * c["IQR"]
+    return c
+
+def make_latency_plot(df, interval, measure, transition=None, include_outliers=True, start=None, end=None):
+    # df may also be the get_latency_windows of a differential frame, to
+    # plot it again without recomputing it
+    c = df if "IQR" in df else get_latency_windows(df, interval, measure, start, end)
+    from matplotlib import pyplot as plt
     plt.figure(figsize=(20, 20))
     plt.plot(c["median"], color="yellow")
     plt.plot(c["maximum"], color="black", alpha=0.5)
@@ -172,8 +869,6 @@ def make_latency_plot(df, interval, measure, transition=None, include_outliers=T
     plt.fill_between(c.index, c["median"], c["75th"], color="red", alpha=0.2);
     plt.fill_between(c.index, c["75th"], c["maximum"], color="blue", alpha=0.2);
     if include_outliers:
-        c["max"] = grouped_latencies[measure].max()
-        c["min"] = grouped_latencies[measure].min()
         plt.plot(c["max"], color="green", alpha=0.5)
         plt.plot(c["min"], color="green", alpha=0.5)
     if transition:
@@ -185,23 +880,116 @@ def linear_polyfit(df, x, y):
 def log_polyfit(df, x, y):
     return np.polyfit(np.log2(df[x]), df[y], 1)
 
-def plot_latency_stats(df, xaxis, title=None, regr=None, ax=None, start=None, end=None):
+# plot_latency_stats reads its series at no more than this many operations
+PLOT_POINTS = 10000
+# The moving averages of plot_latency_stats
+EWM_ALPHA = 0.02
+ROLLING_WINDOW = 1024
+
+class OperationSeries:
+    # The per-operation series of a differential frame, as laid out by
+    # explode_differential_frame (each row repeated by its weight), without
+    # repeating any row. It keeps the end of each row in operations and the
+    # prefix sums that give the rolling mean and the exponentially weighted
+    # mean of measure at any operation exactly, as pandas' rolling(k).mean()
+    # and ewm(alpha).mean() would over the exploded frame.
+    def __init__(self, b, measure="pure_latency(ms)", alpha=EWM_ALPHA):
+        weights = _weights(b)
+        keep = weights > 0
+        self.frame = b.loc[keep]
+        self.measure = measure
+        self.alpha = alpha
+        self.weights = weights[keep]
+        self.values = self.frame[measure].to_numpy(dtype=float)
+        self.ends = np.cumsum(self.weights)
+        self.sums = np.cumsum(self.values * self.weights)
+        self.ewm_numerators = self._ewm_numerators()
+
+    def __len__(self):
+        return int(self.ends[-1]) if len(self.ends) else 0
+
+    def _ewm_numerators(self):
+        # The numerator sum(x[t - i] * (1 - alpha)^i) of the weighted mean
+        # after each row, from the recurrence N = (1 - alpha)^w * N' +
+        # x * (1 - (1 - alpha)^w) / alpha. It's evaluated a chunk of
+        # operations at a time, scaled so that the powers of (1 - alpha)
+        # within a chunk stay within float range.
+        log_beta = np.log1p(-self.alpha)
+        terms = self.values * -np.expm1(self.weights * log_beta) / self.alpha
+        span = max(int(300 / -log_beta), 1)
+        chunks = self.ends // span
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(chunks)) + 1, [len(chunks)]))
+        result = np.empty(len(terms))
+        carry, carry_end = 0., 0
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            ends = self.ends[lo:hi]
+            scale = np.exp((ends - ends[0]) * log_beta)
+            result[lo:hi] = scale * np.cumsum(terms[lo:hi] / scale) + carry * np.exp((ends - carry_end) * log_beta)
+            carry, carry_end = result[hi - 1], ends[-1]
+        return result
+
+    def rows(self, ops):
+        # The row of each operation (0-based)
+        return np.searchsorted(self.ends, np.asarray(ops) + 1, side="left")
+
+    def _prefix_sums(self, counts):
+        # The sum of measure over the first count operations, for each count
+        rows = np.searchsorted(self.ends, counts, side="left")
+        previous = np.maximum(rows - 1, 0)
+        before = np.where(rows > 0, self.ends[previous], 0)
+        sums = np.where(rows > 0, self.sums[previous], 0.)
+        return np.where(counts > 0, sums + (counts - before) * self.values[np.minimum(rows, len(self.values) - 1)], 0.)
+
+    def rolling_mean(self, ops, window=ROLLING_WINDOW):
+        # The mean over each operation and the window - 1 before it, or NaN
+        # where there aren't as many
+        counts = np.asarray(ops) + 1
+        means = (self._prefix_sums(counts) - self._prefix_sums(np.maximum(counts - window, 0))) / window
+        return np.where(counts >= window, means, np.nan)
+
+    def ewm_mean(self, ops):
+        # pandas' ewm(alpha=alpha, adjust=True).mean() at each operation
+        log_beta = np.log1p(-self.alpha)
+        counts = np.asarray(ops) + 1
+        rows = np.searchsorted(self.ends, counts, side="left")
+        previous = np.maximum(rows - 1, 0)
+        since = counts - np.where(rows > 0, self.ends[previous], 0)
+        numerators = (np.exp(since * log_beta) * np.where(rows > 0, self.ewm_numerators[previous], 0.)
+            - self.values[rows] * np.expm1(since * log_beta) / self.alpha)
+        return numerators / (-np.expm1(counts * log_beta) / self.alpha)
+
+def plot_latency_stats(df, xaxis, title=None, regr=None, ax=None, start=None, end=None, points=PLOT_POINTS):
+    # The moving averages and start/end are in operations, not samples.
+    # df is a differential frame or its OperationSeries. The series are read
+    # at every operation between start and end, or at points of them evenly
+    # spaced if there are more.
+    series = df if isinstance(df, OperationSeries) else OperationSeries(df)
+    frame = series.frame
     ylabel="pure_latency(ms)"
-    calc_stats = pandas.DataFrame()
-    calc_stats[xaxis] = df[xaxis]
-    calc_stats["exponential weighted moving avg alpha=0.02"] = df[ylabel].ewm(alpha=0.02).mean()
-    calc_stats["simple moving avg k=1024"] = df[ylabel].rolling(1024).mean()
-    calc_stats["cumulative mean(ms)"] = df["mean_pure_latency(ms)"]
-    calc_stats["cumulative median(ms)"] = df["median_pure_latency(ms)"]
-    if regr is "log":
-        fit = np.polyfit(np.log2(df[xaxis]), df[ylabel], 1)
+    selected = range(len(series))[start:end]
+    if len(selected) <= points:
+        ops = np.arange(selected.start, selected.stop)
+    else:
+        ops = np.unique(np.linspace(selected.start, selected.stop - 1, points).round().astype(np.int64))
+    rows = series.rows(ops)
+    calc_stats = pandas.DataFrame(index=ops)
+    calc_stats[xaxis] = frame[xaxis].to_numpy()[rows]
+    calc_stats["exponential weighted moving avg alpha=0.02"] = series.ewm_mean(ops)
+    calc_stats["simple moving avg k=1024"] = series.rolling_mean(ops)
+    calc_stats["cumulative mean(ms)"] = frame["mean_pure_latency(ms)"].to_numpy()[rows]
+    calc_stats["cumulative median(ms)"] = frame["median_pure_latency(ms)"].to_numpy()[rows]
+    # The fits are over all the operations, with each row counted by its
+    # weight, as in the exploded frame
+    x = frame[xaxis].to_numpy(dtype=float)
+    fit_weights = np.sqrt(series.weights)
+    if regr == "log":
+        fit = np.polyfit(np.log2(x), series.values, 1, w=fit_weights)
         polyfunc=str(fit[0]) + " log2(x) + " + str(fit[1])
-        calc_stats["least sq poly y=" + polyfunc] = np.log2(df[xaxis]) * fit[0] + fit[1]
+        calc_stats["least sq poly y=" + polyfunc] = np.log2(calc_stats[xaxis]) * fit[0] + fit[1]
         print(polyfunc)
-    elif regr is "line":
-        fit = np.polyfit(df[xaxis], df[ylabel], 1)
+    elif regr == "line":
+        fit = np.polyfit(x, series.values, 1, w=fit_weights)
         polyfunc=str(fit[0]) + " x + " + str(fit[1])
-        calc_stats["least sq poly y=" + polyfunc] = df[xaxis] * fit[0] + fit[1]
+        calc_stats["least sq poly y=" + polyfunc] = calc_stats[xaxis] * fit[0] + fit[1]
         print(polyfunc)
-    return calc_stats[start:end].plot(ax=ax, x=xaxis, figsize=(20,20), ylabel="milliseconds", title=title)
-
+    return calc_stats.plot(ax=ax, x=xaxis, figsize=(20,20), ylabel="milliseconds", title=title)
@@ -1,16 +1,12 @@
 import sys
 
-from workload import WorkloadConfig
-from genny_postprocess import print_genny_stats_csv, print_storage_stats_csv, print_timing_stats_csv
-from genny_postprocess import fetch_ftdc_files, convert_ftdc_files
+from evergreen_cache import EVERGREEN_CACHE_DIR
+from workload import EXPORT_DIR, WorkloadConfig
 from ycsb_postprocess import YCSB_SUMMARY_STATS_CSV_FILENAME, YCSB_WC_STATS_CSV_FILENAME
-from ycsb_postprocess import SUMMARY_STATS_HEADERS, WC_STATS_HEADERS
-from ycsb_postprocess import download_and_extract_dsi_artifact
-from ycsb_postprocess import update_ycsb_summary_stats_csv, force_update_ycsb_summary_stats_csv, print_ycsb_summary_stats_csv
-from ycsb_postprocess import update_ycsb_wc_stats_csv, force_update_ycsb_wc_stats_csv, print_ycsb_wc_stats_csv
 
 def usage():
-    print(f"Usage: cli.py <COMMAND> <CONFIG_YML>\n")
+    print(f"Usage: cli.py <COMMAND> <CONFIG_YML>")
+    print(f"       cli.py --help\n")
     print(f"Commands:")
     print(f"  genny_stats       output Genny summary statistics as CSV")
     print(f"  storage_stats     output storage statistics as CSV")
@@ -37,46 +33,128 @@ def usage():
     print(f"                    from YCSB output logs")
     print(f"  ycsb_wc_stats     output the contents of all {YCSB_WC_STATS_CSV_FILENAME} files in the artifacts")
     print(f"                    directory tree")
+    print(f"  update            rebuild the {YCSB_SUMMARY_STATS_CSV_FILENAME} and {YCSB_WC_STATS_CSV_FILENAME} files and the FTDC")
+    print(f"                    conversions that are missing, or whose inputs or parsers changed since they")
+    print(f"                    were built, as recorded in each execution directory's manifest")
+    print(f"  export            write the YCSB stats of all executions, and the Genny stats from cedar, to one")
+    print(f"                    Parquet dataset in {EXPORT_DIR} (or the config's export_dir), partitioned by")
+    print(f"                    workload, patch and variant")
     print(f"  ftdc_to_json      convert FTDC files to JSON files")
     print(f"  ftdc_to_csv       convert FTDC files to CSV files")
+    print(f"  refresh_evergreen_cache")
+    print(f"                    fetch the patches' builds and tasks from Evergreen again, replacing the cached")
+    print(f"                    copies in {EVERGREEN_CACHE_DIR} (or the config's evergreen_cache_dir)")
+
+# Each command imports the modules it needs when it runs, so that a command
+# only pays for loading its own dependencies: requests and pyarrow for the
+# network and export commands, nothing beyond the standard library and PyYAML
+# for the ones that read local files.
+def _refresh_evergreen_cache(wld):
+    print(f"Cached {len(wld.all_executions())} task executions in {wld.evergreen_cache_dir}")
+
+def _genny_stats(wld):
+    from genny_postprocess import print_genny_stats_csv
+    print_genny_stats_csv(wld)
+
+def _storage_stats(wld):
+    from genny_postprocess import print_storage_stats_csv
+    print_storage_stats_csv(wld)
+
+def _timing_stats(wld):
+    from genny_postprocess import print_timing_stats_csv
+    print_timing_stats_csv(wld)
+
+def _fetch_ftdc(wld):
+    from genny_postprocess import fetch_ftdc_files
+    fetch_ftdc_files(wld)
+
+def update_stale_outputs(workload, task_execution):
+    from genny_postprocess import update_stale_ftdc_conversions
+    from ycsb_postprocess import update_stale_ycsb_stats_csvs
+    update_stale_ycsb_stats_csvs(workload, task_execution)
+    update_stale_ftdc_conversions(workload, task_execution)
+
+def _update(wld):
+    wld.iterate_executions(update_stale_outputs, "threads")
+
+def _export(wld):
+    from export import export_stats
+    export_stats(wld)
+
+def _ftdc_to_json(wld):
+    from genny_postprocess import convert_ftdc_files
+    convert_ftdc_files(wld, "json")
+
+def _ftdc_to_csv(wld):
+    from genny_postprocess import convert_ftdc_files
+    convert_ftdc_files(wld, "csv")
+
+def _fetch_artifacts(wld):
+    from ycsb_postprocess import download_and_extract_dsi_artifact
+    wld.iterate_executions(download_and_extract_dsi_artifact, "threads")
+
+def _update_ycsb_summary_stats(wld):
+    from ycsb_postprocess import update_ycsb_summary_stats_csv
+    wld.iterate_executions(update_ycsb_summary_stats_csv, "processes")
+
+def _update_all_ycsb_summary_stats(wld):
+    from ycsb_postprocess import force_update_ycsb_summary_stats_csv
+    wld.iterate_executions(force_update_ycsb_summary_stats_csv, "processes")
+
+def _ycsb_stats(wld):
+    from ycsb_postprocess import SUMMARY_STATS_HEADERS, print_ycsb_summary_stats_csv
+    print(",".join(SUMMARY_STATS_HEADERS))
+    wld.iterate_executions(print_ycsb_summary_stats_csv, "threads")
+
+def _update_ycsb_wc_stats(wld):
+    from ycsb_postprocess import update_ycsb_wc_stats_csv
+    wld.iterate_executions(update_ycsb_wc_stats_csv, "processes")
+
+def _update_all_ycsb_wc_stats(wld):
+    from ycsb_postprocess import force_update_ycsb_wc_stats_csv
+    wld.iterate_executions(force_update_ycsb_wc_stats_csv, "processes")
+
+def _ycsb_wc_stats(wld):
+    from ycsb_postprocess import WC_STATS_HEADERS, print_ycsb_wc_stats_csv
+    print(",".join(WC_STATS_HEADERS))
+    wld.iterate_executions(print_ycsb_wc_stats_csv, "threads")
+
+COMMANDS = {
+    "refresh_evergreen_cache": _refresh_evergreen_cache,
+    "genny_stats": _genny_stats,
+    "storage_stats": _storage_stats,
+    "timing_stats": _timing_stats,
+    "fetch_ftdc": _fetch_ftdc,
+    "update": _update,
+    "export": _export,
+    "ftdc_to_json": _ftdc_to_json,
+    "ftdc_to_csv": _ftdc_to_csv,
+    "fetch_artifacts": _fetch_artifacts,
+    "update_ycsb_summary_stats": _update_ycsb_summary_stats,
+    "update_all_ycsb_summary_stats": _update_all_ycsb_summary_stats,
+    "ycsb_stats": _ycsb_stats,
+    "update_ycsb_wc_stats": _update_ycsb_wc_stats,
+    "update_all_ycsb_wc_stats": _update_all_ycsb_wc_stats,
+    "ycsb_wc_stats": _ycsb_wc_stats,
+}
+
+# Commands that need more than the Evergreen cache and the local files
+NETWORK_COMMANDS = ["genny_stats", "storage_stats", "timing_stats", "fetch_ftdc", "fetch_artifacts"]
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ["-h", "--help"]:
+        usage()
+        sys.exit(0)
     if len(sys.argv) < 3:
         usage()
         raise Exception(f"Need a command and a YAML file")
 
     cmd = sys.argv[1]
     cfg = sys.argv[2]
-    wld = WorkloadConfig(cfg)
-
-    if cmd == "genny_stats":
-        print_genny_stats_csv(wld)
-    elif cmd == "storage_stats":
-        print_storage_stats_csv(wld)
-    elif cmd == "timing_stats":
-        print_timing_stats_csv(wld)
-    elif cmd == "fetch_ftdc":
-        wld.iterate_tasks(fetch_ftdc_files)
-    elif cmd == "ftdc_to_json":
-        convert_ftdc_files(wld, "json")
-    elif cmd == "ftdc_to_csv":
-        convert_ftdc_files(wld, "csv")
-    elif cmd == "fetch_artifacts":
-        wld.iterate_executions(download_and_extract_dsi_artifact)
-    elif cmd == "update_ycsb_summary_stats":
-        wld.iterate_executions(update_ycsb_summary_stats_csv)
-    elif cmd == "update_all_ycsb_summary_stats":
-        wld.iterate_executions(force_update_ycsb_summary_stats_csv)
-    elif cmd == "ycsb_stats":
-        print(",".join(SUMMARY_STATS_HEADERS))
-        wld.iterate_executions(print_ycsb_summary_stats_csv)
-    elif cmd == "update_ycsb_wc_stats":
-        wld.iterate_executions(update_ycsb_wc_stats_csv)
-    elif cmd == "update_all_ycsb_wc_stats":
-        wld.iterate_executions(force_update_ycsb_wc_stats_csv)
-    elif cmd == "ycsb_wc_stats":
-        print(",".join(WC_STATS_HEADERS))
-        wld.iterate_executions(print_ycsb_wc_stats_csv)
-    else:
+    if cmd not in COMMANDS:
         usage()
         raise Exception(f"Unknown command: {cmd}")
+    wld = WorkloadConfig(cfg, refresh=(cmd == "refresh_evergreen_cache"))
+    if wld.offline and cmd in NETWORK_COMMANDS:
+        raise Exception(f"{cmd} needs network access, but offline is set in {cfg}")
+    COMMANDS[cmd](wld)
@@ -0,0 +1,73 @@
+import json
+import os
+
+from collections import namedtuple
+from pathlib import Path
+
+EVERGREEN_CACHE_DIR = ".evergreen_cache"
+EVERGREEN_CACHE_VERSION = 2
+# Tasks in any other state may still change, so they are fetched again
+# rather than served from the cache
+COMPLETED_TASK_STATUSES = ["success", "failed"]
+
+# The fields of Evergreen tasks and task executions that the postprocessors
+# read. Unlike evergreen.py's Task, these hold no API client, so they can be
+# cached as JSON and sent to worker processes.
+ArtifactInfo = namedtuple("ArtifactInfo", ["name", "url"])
+ExecutionInfo = namedtuple("ExecutionInfo", ["task_id", "version_id", "build_variant", "display_name",
+    "execution", "status", "artifacts"])
+
+class TaskInfo(namedtuple("TaskInfo", ["task_id", "display_name", "build_variant", "execution", "status",
+        "executions"])):
+    def get_execution(self, execution):
+        for x in self.executions:
+            if x.execution == execution:
+                return x
+        return None
+
+def execution_info(execution):
+    return ExecutionInfo(execution.task_id, execution.version_id, execution.build_variant,
+        execution.display_name, execution.execution, execution.status,
+        [ArtifactInfo(x.name, x.url) for x in execution.artifacts])
+
+def task_info(task):
+    executions = [task.get_execution(x) for x in range(task.execution + 1)]
+    return TaskInfo(task.task_id, task.display_name, task.build_variant, task.execution, task.status,
+        [execution_info(x) for x in executions if x is not None])
+
+def build_listing(build):
+    # A build's ID and the [ID, display name] pairs of its tasks. The names
+    # come from the build's task cache, and are None where it has no entry.
+    names = {x["id"]: x.get("display_name") for x in build.task_cache or []}
+    return {"id": build.id, "tasks": [[x, names.get(x)] for x in build.tasks]}
+
+def is_task_completed(task):
+    return task.status in COMPLETED_TASK_STATUSES
+
+def _task_from_json(obj):
+    executions = [ExecutionInfo(*x[:-1], [ArtifactInfo(*a) for a in x[-1]]) for x in obj[-1]]
+    return TaskInfo(*obj[:-1], executions)
+
+def get_version_cache_path(cache_dir, patch_id):
+    return os.path.join(cache_dir, f"{patch_id}.json")
+
+def load_version_cache(cache_dir, patch_id):
+    # Returns the cached build variant -> build listing of an Evergreen
+    # version and its cached tasks by ID, or (None, {}) if it isn't cached.
+    path = get_version_cache_path(cache_dir, patch_id)
+    try:
+        with open(path, "r") as fstream:
+            obj = json.load(fstream)
+        if obj["cache_version"] != EVERGREEN_CACHE_VERSION:
+            return None, {}
+        return obj["builds"], {k: _task_from_json(v) for k, v in obj["tasks"].items()}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, {}
+
+def save_version_cache(cache_dir, patch_id, builds, tasks):
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    path = get_version_cache_path(cache_dir, patch_id)
+    obj = {"cache_version": EVERGREEN_CACHE_VERSION, "builds": builds, "tasks": tasks}
+    with open(path + ".part", "w") as fstream:
+        json.dump(obj, fstream)
+    os.replace(path + ".part", path)
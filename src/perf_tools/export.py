@@ -0,0 +1,64 @@
+import os
+import pandas
+import pyarrow
+import pyarrow.dataset
+
+from genny_postprocess import get_stats_tables
+from ycsb_postprocess import YCSB_SUMMARY_STATS_CSV_FILENAME, YCSB_WC_STATS_CSV_FILENAME, get_output_dir
+
+# The export command writes each table to <export_dir>/<table>/ as Parquet,
+# partitioned into Workload=<name>/Patch ID=<id>/Topology=<variant>/
+# directories. Exporting a patch again replaces its partitions.
+PARTITION_COLUMNS = ["Workload", "Patch ID", "Topology"]
+# Every other column is numeric: Execution is an integer and the metrics are
+# floats, null where a metric is missing
+STRING_COLUMNS = PARTITION_COLUMNS + ["Task Name", "Test", "Node"]
+
+def _column_type(name):
+    if name in STRING_COLUMNS:
+        return pyarrow.string()
+    if name == "Execution":
+        return pyarrow.int64()
+    return pyarrow.float64()
+
+def _write_table(export_dir, name, workload, df):
+    df.insert(0, "Workload", workload.workload_name)
+    for col in df.columns:
+        if col not in STRING_COLUMNS:
+            df[col] = pandas.to_numeric(df[col])
+    schema = pyarrow.schema([(col, _column_type(col)) for col in df.columns])
+    table = pyarrow.Table.from_pandas(df, schema=schema, preserve_index=False)
+    path = os.path.join(export_dir, name)
+    pyarrow.dataset.write_dataset(table, path, format="parquet", partitioning=PARTITION_COLUMNS,
+        partitioning_flavor="hive", existing_data_behavior="delete_matching")
+    print(f"Exported {len(df)} rows to {path}")
+
+def _read_execution_csvs(workload, filename):
+    frames = []
+    for execution in workload.all_executions():
+        path = os.path.join(get_output_dir(workload, execution), filename)
+        if os.path.isfile(path):
+            frames.append(pandas.read_csv(path, dtype=str))
+    return pandas.concat(frames, ignore_index=True) if frames else None
+
+def export_stats(workload):
+    # Writes the YCSB summary and write conflict stats of every execution and,
+    # unless offline, the Genny stats from Cedar to workload.export_dir
+    export_dir = workload.export_dir
+    for name, filename in [("ycsb_stats", YCSB_SUMMARY_STATS_CSV_FILENAME), ("ycsb_wc_stats", YCSB_WC_STATS_CSV_FILENAME)]:
+        df = _read_execution_csvs(workload, filename)
+        if df is not None:
+            _write_table(export_dir, name, workload, df)
+
+    metrics = [(name, x) for name, x in [("genny_stats", workload.genny_metrics),
+        ("storage_stats", workload.storage_metrics), ("timing_stats", workload.timing_metrics)] if x is not None]
+    if not metrics:
+        return
+    if workload.offline:
+        print(f"Skipping {', '.join(name for name, _ in metrics)}, which need Cedar, because offline is set")
+        return
+    tables = get_stats_tables(workload, [x for _, x in metrics])
+    for (name, metrics_obj), csv_dict in zip(metrics, tables):
+        df = pandas.DataFrame(csv_dict, columns=metrics_obj.get_all_headers())
+        if len(df):
+            _write_table(export_dir, name, workload, df)
@@ -0,0 +1,256 @@
+import base64
+import codecs
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tarfile
+
+from contextlib import contextmanager
+from pathlib import Path
+
+DEFAULT_MAX_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+JSON_STREAM_CHUNK_SIZE = 1 << 16
+JSON_WHITESPACE_PATTERN = re.compile("[ \t\n\r]*")
+REQUEST_TIMEOUT = (10, 300)
+
+def log(msg):
+    # print() writes the message and the newline separately, which interleaves
+    # the output of concurrent workers; a single write keeps lines intact.
+    sys.stdout.write(msg + "\n")
+
+def make_session(max_workers=DEFAULT_MAX_WORKERS, retries=5, backoff_factor=0.5):
+    # A keep-alive session whose connection pool is large enough for every
+    # worker, retrying connection errors and transient server errors with
+    # exponential backoff. requests is imported here rather than at the top,
+    # so that the commands that don't fetch anything don't pay for loading it.
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET", "HEAD"])
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def map_concurrently(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    # Like map(func, items), but with up to max_workers calls in flight.
+    # Results are returned in the order of items.
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(func, items))
+
+def _expected_total_size(rsp, offset):
+    # Total size of the resource, from either a 206 or a 200 response
+    content_range = rsp.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = rsp.headers.get("Content-Length")
+    if length is None or rsp.headers.get("Content-Encoding"):
+        return None
+    return offset + int(length) if rsp.status_code == 206 else int(length)
+
+def _file_digest(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as fstream:
+        for chunk in iter(lambda: fstream.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+def _verify_download(part_path, expected_size, checksum, content_md5):
+    size = os.path.getsize(part_path)
+    if expected_size is not None and size != expected_size:
+        if size > expected_size:
+            os.remove(part_path)
+        raise Exception(f"Downloaded {size} bytes to {part_path}, expected {expected_size}")
+    if checksum is not None:
+        algorithm, expected = checksum
+        actual = _file_digest(part_path, algorithm).hexdigest()
+        if actual != expected.lower():
+            os.remove(part_path)
+            raise Exception(f"{algorithm} of {part_path} is {actual}, expected {expected}")
+    if content_md5 is not None:
+        actual = base64.b64encode(_file_digest(part_path, "md5").digest()).decode()
+        if actual != content_md5:
+            os.remove(part_path)
+            raise Exception(f"MD5 of {part_path} is {actual}, expected {content_md5}")
+
+def download_to_file(session, url, path, expected_size=None, checksum=None,
+        retries=5, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    # Streams the response body to path without holding it in memory. The
+    # data is written to a .part file, which is resumed with an HTTP Range
+    # request if the transfer breaks off (here or in an earlier run), and
+    # only renamed to path once its size, and its checksum when known, have
+    # been verified. checksum is an optional (hashlib algorithm, hex digest)
+    # pair; a Content-MD5 response header is checked as well.
+    import requests
+
+    part_path = path + ".part"
+    content_md5 = None
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(url, stream=True, headers=headers, timeout=REQUEST_TIMEOUT) as rsp:
+                if offset and rsp.status_code == 416:
+                    # Nothing left to fetch: the .part file is already complete
+                    break
+                rsp.raise_for_status()
+                if rsp.status_code != 206:
+                    offset = 0
+                total = _expected_total_size(rsp, offset)
+                if expected_size is None:
+                    expected_size = total
+                if rsp.status_code == 200:
+                    content_md5 = rsp.headers.get("Content-MD5")
+                with open(part_path, "ab" if offset else "wb") as fstream:
+                    for chunk in rsp.iter_content(chunk_size=chunk_size):
+                        fstream.write(chunk)
+            if expected_size is None or os.path.getsize(part_path) >= expected_size:
+                break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            if attempt == retries:
+                raise
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        log(f"Download of {url} was interrupted, resuming from byte {offset}")
+
+    _verify_download(part_path, expected_size, checksum, content_md5)
+    os.replace(part_path, path)
+    return path
+
+def _read_text(chunks, utf8):
+    # The next piece of text from an iterator of UTF-8 byte chunks, and
+    # whether the chunks have run out
+    chunk = next(chunks, None)
+    if chunk is None:
+        return utf8.decode(b"", final=True), True
+    return utf8.decode(chunk), False
+
+def _read_more_text(chunks, utf8, buf):
+    # buf followed by at least as much text again, or by the rest of the
+    # text, and whether the chunks have run out
+    parts = [buf]
+    size = 0
+    while True:
+        text, eof = _read_text(chunks, utf8)
+        parts.append(text)
+        size += len(text)
+        if eof or size >= len(buf):
+            return "".join(parts), eof
+
+def _skip_whitespace(buf, pos):
+    return JSON_WHITESPACE_PATTERN.match(buf, pos).end()
+
+def _may_continue(value, buf, end):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        end = _skip_whitespace(buf, end)
+        return buf[end:end + 1] not in [",", "]"]
+    return False
+
+def iter_json_array(chunks):
+    # Yields the elements of the JSON array whose UTF-8 text arrives in
+    # chunks (e.g. a streamed response's iter_content()), each as soon as it
+    # has been read. Only the element being read is held in memory, not the
+    # whole array. Raises ValueError if the text isn't a JSON array.
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf, pos, eof = "", 0, False
+    expected = "["
+    while True:
+        pos = _skip_whitespace(buf, pos)
+        if pos == len(buf):
+            if eof:
+                raise ValueError("JSON array is truncated")
+            buf, eof = _read_text(chunks, utf8)
+            pos = 0
+            continue
+        if expected == "[":
+            if buf[pos] != "[":
+                raise ValueError(f"Expected a JSON array, got {buf[pos:pos + 20]!r}")
+            pos += 1
+            expected = "first"
+        elif expected == "first" and buf[pos] == "]":
+            return
+        elif expected in ["first", "value"]:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+            # An incomplete element, or a number that may continue in the next
+            # chunk (e.g. "12" of "12.5"). The element is decoded again once
+            # the text buffered for it has at least doubled, so a large one is
+            # decoded a few times over rather than once per chunk.
+            if end is None or (not eof and _may_continue(value, buf, end)):
+                buf, eof = _read_more_text(chunks, utf8, buf[pos:])
+                pos = 0
+                continue
+            yield value
+            pos = end
+            expected = ","
+        elif buf[pos] == ",":
+            pos += 1
+            expected = "value"
+        elif buf[pos] == "]":
+            return
+        else:
+            raise ValueError(f"Expected ',' or ']' in JSON array, got {buf[pos:pos + 20]!r}")
+
+def _safe_member_path(dest_dir, name):
+    path = os.path.normpath(os.path.join(dest_dir, name))
+    if os.path.isabs(name) or not path.startswith(os.path.normpath(dest_dir) + os.sep):
+        raise Exception(f"Refusing to extract {name} outside of {dest_dir}")
+    return path
+
+def normalize_member_name(name):
+    name = os.path.normpath(name)
+    return name[2:] if name.startswith("./") else name
+
+def iter_tarball_members(fileobj, member_filter):
+    # Reads a .tgz sequentially from fileobj, yielding (name, file object)
+    # for each regular file whose normalized name satisfies member_filter.
+    # Each file object is only valid until the next member is requested.
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+        for member in tar:
+            name = normalize_member_name(member.name)
+            if not member.isfile() or not member_filter(name):
+                continue
+            with tar.extractfile(member) as src:
+                yield name, src
+
+def extract_tarball_members(fileobj, dest_dir, member_filter):
+    # Extracts the members of the .tgz read from fileobj that satisfy
+    # member_filter into dest_dir; the rest are skipped without touching the
+    # disk. Returns the names of the extracted members.
+    extracted = []
+    for name, src in iter_tarball_members(fileobj, member_filter):
+        path = _safe_member_path(dest_dir, name)
+        Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        with open(path + ".part", "wb") as dst:
+            shutil.copyfileobj(src, dst, DOWNLOAD_CHUNK_SIZE)
+        os.replace(path + ".part", path)
+        extracted.append(name)
+    return extracted
+
+@contextmanager
+def open_url_stream(session, url):
+    # The response body of url as a binary file object, read as it arrives
+    with session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as rsp:
+        rsp.raise_for_status()
+        rsp.raw.decode_content = True
+        yield rsp.raw
+
+def stream_extract_tarball(session, url, dest_dir, member_filter):
+    # extract_tarball_members on the .tgz at url, decompressing the response
+    # as it arrives; the tarball itself is never written to disk.
+    with open_url_stream(session, url) as fileobj:
+        return extract_tarball_members(fileobj, dest_dir, member_filter)
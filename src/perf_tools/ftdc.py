@@ -0,0 +1,200 @@
+import numpy as np
+import struct
+import zlib
+
+# Reads FTDC files, such as the metrics Genny actors write, straight into
+# NumPy columns, without going through `curator ftdc export`.
+#
+# An FTDC file is a sequence of BSON documents. Those with type 1 hold a
+# chunk of samples in their "data" field: a little-endian uint32 holding the
+# uncompressed size, then zlib-compressed
+#   - a BSON reference document: the first sample
+#   - uint32 metric count, uint32 delta count (the samples after the first)
+#   - for each metric in turn, the unsigned varint deltas of its samples
+#     from the one before, where a 0 delta is followed by the number of
+#     further 0 deltas.
+# The metrics of a sample are the numeric leaves of its document, in
+# document order, named by their dotted paths (e.g. "counters.ops").
+FTDC_METRIC_CHUNK = 1
+
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+_UINT32 = struct.Struct("<I")
+_DOUBLE = struct.Struct("<d")
+
+def _cstring_end(buf, pos):
+    return buf.index(b"\x00", pos)
+
+def _skip_value(buf, pos, bson_type):
+    # The position after a value that isn't a metric
+    if bson_type in (0x02, 0x0D, 0x0E):  # string, JavaScript, symbol
+        return pos + 4 + _INT32.unpack_from(buf, pos)[0]
+    if bson_type == 0x05:  # binary
+        return pos + 5 + _INT32.unpack_from(buf, pos)[0]
+    if bson_type in (0x06, 0x0A, 0x7F, 0xFF):  # undefined, null, max key, min key
+        return pos
+    if bson_type == 0x07:  # ObjectId
+        return pos + 12
+    if bson_type == 0x0B:  # regex
+        return _cstring_end(buf, _cstring_end(buf, pos) + 1) + 1
+    if bson_type == 0x0C:  # DBPointer
+        return pos + 4 + _INT32.unpack_from(buf, pos)[0] + 12
+    if bson_type == 0x0F:  # code with scope
+        return pos + _INT32.unpack_from(buf, pos)[0]
+    if bson_type == 0x13:  # decimal128
+        return pos + 16
+    raise ValueError(f"Unknown BSON type {bson_type:#x}")
+
+def _document_metrics(buf, pos=0, prefix="", metrics=None):
+    # The (name, value, is_double) metrics of the BSON document at pos, in
+    # the order the FTDC encoder visits them
+    if metrics is None:
+        metrics = []
+    end = pos + _INT32.unpack_from(buf, pos)[0] - 1
+    pos += 4
+    while pos < end:
+        bson_type = buf[pos]
+        name_end = _cstring_end(buf, pos + 1)
+        name = prefix + buf[pos + 1:name_end].decode()
+        pos = name_end + 1
+        if bson_type in (0x03, 0x04):  # document, array
+            _document_metrics(buf, pos, name + ".", metrics)
+            pos += _INT32.unpack_from(buf, pos)[0]
+        elif bson_type == 0x01:
+            metrics.append((name, _INT64.unpack_from(buf, pos)[0], True))
+            pos += 8
+        elif bson_type == 0x10:
+            metrics.append((name, _INT32.unpack_from(buf, pos)[0], False))
+            pos += 4
+        elif bson_type in (0x09, 0x12):  # date (ms since the epoch), int64
+            metrics.append((name, _INT64.unpack_from(buf, pos)[0], False))
+            pos += 8
+        elif bson_type == 0x08:
+            metrics.append((name, buf[pos], False))
+            pos += 1
+        elif bson_type == 0x11:  # timestamp: increment, then seconds
+            increment, seconds = struct.unpack_from("<II", buf, pos)
+            metrics.append((name, seconds, False))
+            metrics.append((name + ".inc", increment, False))
+            pos += 8
+        else:
+            pos = _skip_value(buf, pos, bson_type)
+    return metrics
+
+def _chunk_data(buf, pos):
+    # The type and the "data" bytes of the top-level document at pos
+    end = pos + _INT32.unpack_from(buf, pos)[0] - 1
+    pos += 4
+    doc_type, data = None, None
+    while pos < end:
+        bson_type = buf[pos]
+        name_end = _cstring_end(buf, pos + 1)
+        name = buf[pos + 1:name_end]
+        pos = name_end + 1
+        if name == b"type" and bson_type == 0x10:
+            doc_type = _INT32.unpack_from(buf, pos)[0]
+            pos += 4
+        elif name == b"data" and bson_type == 0x05:
+            size = _INT32.unpack_from(buf, pos)[0]
+            data = buf[pos + 5:pos + 5 + size]
+            pos += 5 + size
+        elif bson_type in (0x03, 0x04):
+            pos += _INT32.unpack_from(buf, pos)[0]
+        elif bson_type == 0x01 or bson_type in (0x09, 0x11, 0x12):
+            pos += 8
+        elif bson_type == 0x10:
+            pos += 4
+        elif bson_type == 0x08:
+            pos += 1
+        else:
+            pos = _skip_value(buf, pos, bson_type)
+    return doc_type, data
+
+def _decode_varints(buf):
+    # All the unsigned varints in buf, decoded at once
+    data = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) == len(data):
+        return data.astype(np.uint64)
+    if len(ends) == 0 or ends[-1] != len(data) - 1:
+        raise ValueError("FTDC chunk ends in the middle of a varint")
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    values = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(values, starts)
+
+def _expand_zero_runs(tokens):
+    # Expands the run-length encoded deltas. A token is a count of further
+    # zeros iff it follows a 0 delta. A token after a non-zero token is a
+    # delta, so within a run of 0 tokens deltas and counts alternate, and the
+    # token after an odd-length run is a count.
+    is_zero = tokens == 0
+    n = len(tokens)
+    index = np.arange(n)
+    run_start = np.where(is_zero & ~np.concatenate(([False], is_zero[:-1])), index, 0)
+    run_start = np.maximum.accumulate(run_start)
+    is_count = is_zero & ((index - run_start) % 2 == 1)
+    after_run = np.flatnonzero(~is_zero[1:] & is_zero[:-1]) + 1
+    is_count[after_run] = (after_run - run_start[after_run - 1]) % 2 == 1
+    repeats = np.where(is_count, tokens, 1)
+    return np.repeat(np.where(is_count, 0, tokens), repeats.astype(np.int64))
+
+def decode_ftdc_chunk(data):
+    # The metrics of a chunk's "data" bytes, as a dict of name -> column,
+    # in document order. Columns are int64, or float64 for metrics stored as
+    # BSON doubles (which Genny's FTDC writer encodes by their bits).
+    if len(data) < 4:
+        raise ValueError("FTDC chunk is truncated")
+    payload = zlib.decompress(data[4:])
+    if len(payload) != _UINT32.unpack_from(data)[0]:
+        raise ValueError(f"FTDC chunk is {len(payload)} bytes, expected {_UINT32.unpack_from(data)[0]}")
+    reference = _document_metrics(payload)
+    pos = _INT32.unpack_from(payload)[0]
+    nmetrics, ndeltas = struct.unpack_from("<II", payload, pos)
+    if nmetrics != len(reference):
+        raise ValueError(f"FTDC chunk has {nmetrics} metrics, its reference document {len(reference)}")
+
+    deltas = _expand_zero_runs(_decode_varints(payload[pos + 8:]))
+    if len(deltas) < nmetrics * ndeltas:
+        raise ValueError(f"FTDC chunk has {len(deltas)} deltas, expected {nmetrics * ndeltas}")
+    samples = np.empty((nmetrics, ndeltas + 1), dtype=np.uint64)
+    samples[:, 0] = np.array([value for _, value, _ in reference], dtype=np.int64).view(np.uint64)
+    samples[:, 1:] = deltas[:nmetrics * ndeltas].reshape(nmetrics, ndeltas)
+    # Deltas wrap around like the unsigned 64 bit integers they're encoded as
+    values = np.cumsum(samples, axis=1, dtype=np.uint64).view(np.int64)
+    return {name: values[i].view(np.float64) if is_double else values[i]
+            for i, (name, _, is_double) in enumerate(reference)}
+
+def iter_ftdc_chunks(path):
+    # Yields the metric columns of each chunk of the FTDC file at path.
+    # Metadata documents are skipped.
+    with open(path, "rb") as fstream:
+        buf = fstream.read()
+    pos = 0
+    while pos < len(buf):
+        if pos + 4 > len(buf) or pos + _INT32.unpack_from(buf, pos)[0] > len(buf):
+            raise ValueError(f"{path} is truncated at byte {pos}")
+        doc_type, data = _chunk_data(buf, pos)
+        pos += _INT32.unpack_from(buf, pos)[0]
+        if doc_type == FTDC_METRIC_CHUNK and data is not None:
+            yield decode_ftdc_chunk(data)
+
+def read_ftdc(path, names=None):
+    # The FTDC file's metrics as a dict of name -> column, with the chunks
+    # joined end to end. names selects the metrics; every chunk must have
+    # them. By default, the metrics of the first chunk are read.
+    parts = None
+    for chunk in iter_ftdc_chunks(path):
+        if names is None:
+            names = list(chunk)
+        if parts is None:
+            parts = {name: [] for name in names}
+        for name in names:
+            if name not in chunk:
+                raise ValueError(f"A chunk of {path} has no {name} metric")
+            parts[name].append(chunk[name])
+    if parts is None:
+        return {name: np.empty(0, dtype=np.int64) for name in names or []}
+    return {name: np.concatenate(columns) for name, columns in parts.items()}
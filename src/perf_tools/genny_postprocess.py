@@ -1,12 +1,34 @@
-
-import requests
+import gzip
 import os
+import shutil
 import subprocess
+import sys
+import tempfile
+import time
 
-from multiprocessing.pool import ThreadPool
+from contextlib import nullcontext
 from pathlib import Path
 
-from csv import print_csv
+from fetch import JSON_STREAM_CHUNK_SIZE, REQUEST_TIMEOUT, log, make_session, map_concurrently, download_to_file
+from fetch import iter_json_array
+from manifest import get_stale_record, record_output, save_record
+from parallel import run_with_budget
+from writer import TableWriter
+
+# Bump this when the FTDC conversions change, so that the update command
+# rebuilds them
+FTDC_CONVERSION_VERSION = 1
+# curator's output is copied to disk in writes of this size
+CONVERSION_WRITE_BUFFER_SIZE = 1 << 20
+# The memory a conversion is expected to need, as a multiple of the size of
+# its FTDC file. Conversions are started while their estimates fit in the
+# config's conversion_memory_mb.
+CONVERSION_MEMORY_PER_FTDC_BYTE = 4
+# How FTDC conversions can be compressed, and the suffix each adds to the
+# output's name. The fast levels keep up with curator's output.
+CONVERSION_COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
 
 def get_output_dir(workload, task_execution):
     return os.path.join(workload.workload_name, task_execution.version_id, task_execution.build_variant,
@@ -17,19 +39,41 @@ def setup_output_dir(workload, task_execution):
     Path(path).mkdir(parents=True, exist_ok=True)
     return path
 
-def fetch_ftdc_files(workload, task):
-    if workload.genny_metrics is None:
-        raise Exception(f"Must specify a genny_metrics element in config YAML to fetch ftdc artifacts")
+def _is_selected_result(obj, tests):
+    # Cedar results of other tests are dropped as soon as they are parsed.
+    # Malformed results are kept, for the stats extractor to report.
+    try:
+        return obj["info"]["test_name"] in tests
+    except (KeyError, TypeError):
+        return True
+
+def _fetch_cedar_task(workload, session, task, tests):
+    # The Cedar results of the task for the given tests. The response is
+    # parsed as it streams in, so it is never held in memory as a whole.
+    import requests
 
     tid = task.task_id
     try:
-        rsp = requests.get(f"https://cedar.mongodb.com/rest/v1/perf/task_id/{tid}")
-        rsp.raise_for_status()
-    except:
-        print(f"Cedar fetch failed for task {tid}")
-        return
+        with session.get(f"{workload.cedar_url}/perf/task_id/{tid}", stream=True,
+                timeout=REQUEST_TIMEOUT) as rsp:
+            rsp.raise_for_status()
+            results = iter_json_array(rsp.iter_content(chunk_size=JSON_STREAM_CHUNK_SIZE))
+            return [x for x in results if _is_selected_result(x, tests)]
+    except (requests.RequestException, ValueError):
+        log(f"Cedar fetch failed for task {tid}")
+        return None
 
-    json_obj = rsp.json()
+def _iter_cedar_tasks(workload, session, tests):
+    # Fetches the Cedar results of every task for the given tests
+    # concurrently, yielding them in the order of workload.all_tasks()
+    tasks = workload.all_tasks()
+    tests = set(tests)
+    results = map_concurrently(lambda task: _fetch_cedar_task(workload, session, task, tests),
+        tasks, workload.max_workers)
+    return zip(tasks, results)
+
+def _get_ftdc_downloads(workload, task, json_obj):
+    downloads = []
     for obj in json_obj:
         test_name = obj["info"]["test_name"]
         if test_name not in workload.genny_metrics.tests:
@@ -45,69 +89,182 @@ def fetch_ftdc_files(workload, task):
             continue
         try:
             uri = obj["artifacts"][0]["download_url"]
-            print(f"Fetching {uri}...")
-            rsp = requests.get(uri)
-            rsp.raise_for_status()
-        except:
+        except (KeyError, IndexError):
             continue
         setup_output_dir(workload, task_execution)
-        open(path, "wb").write(rsp.content)
-        print(f"Saved artifact to {path}")
+        downloads.append((uri, path))
+    return downloads
 
-def _print_stats_csv(workload, task, metrics_obj):
-    if not metrics_obj:
-        raise Exception(f"No ${metrics_obj.yaml_name} YAML node to report summary stats")
+def _download_ftdc_file(session, uri, path):
+    import requests
 
-    headers = metrics_obj.get_all_headers()
-    csv_dict = {key: [] for key in headers}
-    tid = task.task_id
+    log(f"Fetching {uri}...")
     try:
-        rsp = requests.get(f"https://cedar.mongodb.com/rest/v1/perf/task_id/{tid}")
-        rsp.raise_for_status()
-    except:
+        download_to_file(session, uri, path)
+    except requests.RequestException:
+        log(f"Failed to download {uri}")
         return
-    metrics_obj.get_stats_as_csv(rsp.json(), headers, csv_dict)
-    print_csv(csv_dict, headers)
+    log(f"Saved artifact to {path}")
+
+def fetch_ftdc_files(workload):
+    if workload.genny_metrics is None:
+        raise Exception(f"Must specify a genny_metrics element in config YAML to fetch ftdc artifacts")
+
+    session = make_session(workload.max_workers)
+    downloads = []
+    for task, json_obj in _iter_cedar_tasks(workload, session, workload.genny_metrics.tests):
+        if json_obj is not None:
+            downloads.extend(_get_ftdc_downloads(workload, task, json_obj))
+    map_concurrently(lambda d: _download_ftdc_file(session, *d), downloads, workload.max_workers)
+
+def _report_skipped_results(task, metrics_obj, skipped):
+    # Written to stderr, as stdout may be carrying the table
+    reasons = ", ".join(f"{count} {reason}" for reason, count in skipped.items() if count)
+    if reasons:
+        sys.stderr.write(f"Skipped {metrics_obj.yaml_name} results of task {task.task_id}: {reasons}\n")
+
+def _print_stats_csv(workload, metrics_obj):
+    if not metrics_obj:
+        raise Exception(f"No ${metrics_obj.yaml_name} YAML node to report summary stats")
+
+    fstream = sys.stdout.buffer if workload.output_format == "parquet" else sys.stdout
+    writer = TableWriter(fstream, metrics_obj.get_all_headers(), workload.output_format)
+    session = make_session(workload.max_workers)
+    for task, json_obj in _iter_cedar_tasks(workload, session, metrics_obj.tests):
+        if json_obj is None:
+            continue
+        csv_dict, skipped = metrics_obj.get_stats_as_csv(json_obj)
+        _report_skipped_results(task, metrics_obj, skipped)
+        writer.write(csv_dict)
+    writer.close()
+
+def get_stats_tables(workload, metrics_objs):
+    # The CSV tables of several TestAndMetrics, built from one pass over the
+    # Cedar results
+    tables = [{key: [] for key in x.get_all_headers()} for x in metrics_objs]
+    session = make_session(workload.max_workers)
+    tests = [test for x in metrics_objs for test in x.tests]
+    for task, json_obj in _iter_cedar_tasks(workload, session, tests):
+        if json_obj is None:
+            continue
+        for metrics_obj, table in zip(metrics_objs, tables):
+            csv_dict, skipped = metrics_obj.get_stats_as_csv(json_obj)
+            _report_skipped_results(task, metrics_obj, skipped)
+            for key, values in csv_dict.items():
+                table[key].extend(values)
+    return tables
 
 def print_genny_stats_csv(workload):
-    def cb(workload, task):
-        _print_stats_csv(workload, task, workload.genny_metrics)
-    print(",".join(workload.genny_metrics.get_all_headers()))
-    workload.iterate_tasks(cb)
+    _print_stats_csv(workload, workload.genny_metrics)
 
 def print_storage_stats_csv(workload):
-    print(",".join(workload.storage_metrics.get_all_headers()))
-    workload.iterate_tasks(lambda wld, tsk : _print_stats_csv(wld, tsk, wld.storage_metrics))
+    _print_stats_csv(workload, workload.storage_metrics)
 
 def print_timing_stats_csv(workload):
-    print(",".join(workload.timing_metrics.get_all_headers()))
-    workload.iterate_tasks(lambda wld, tsk : _print_stats_csv(wld, tsk, wld.timing_metrics))
+    _print_stats_csv(workload, workload.timing_metrics)
+
+def _ftdc_conversion_version(workload):
+    # Conversions are rebuilt by the update command when curator changes
+    return f"{FTDC_CONVERSION_VERSION} {workload.curator_binpath}"
+
+def _compressed_writer(fstream, compression):
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=fstream, mode="wb", compresslevel=GZIP_LEVEL)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(fstream, closefd=False)
+    return nullcontext(fstream)
+
+def _run_curator_export(cmd, out_path, compression="none"):
+    # Runs the export, copying its output to out_path through a .part file
+    # that is renamed only once curator has succeeded, so an interrupted or
+    # failed conversion never leaves a partial output behind
+    part_path = out_path + ".part"
+    try:
+        with open(part_path, "wb", CONVERSION_WRITE_BUFFER_SIZE) as fstream, tempfile.TemporaryFile() as errstream:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errstream)
+            with proc.stdout, _compressed_writer(fstream, compression) as writer:
+                shutil.copyfileobj(proc.stdout, writer, CONVERSION_WRITE_BUFFER_SIZE)
+            returncode = proc.wait()
+            errstream.seek(0)
+            stderr = errstream.read().decode(errors="replace").strip()
+        if returncode != 0:
+            raise Exception(f"{' '.join(cmd)} exited with status {returncode}: {stderr}")
+        os.replace(part_path, out_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+def get_conversion_path(workload, ftdc_path, format):
+    return f"{ftdc_path}.{format}{CONVERSION_COMPRESSION_SUFFIXES[workload.conversion_compression]}"
+
+def _convert_ftdc(workload, ftdc_path, format, manifest_record=None):
+    out_path = get_conversion_path(workload, ftdc_path, format)
+    log(f"Converting {ftdc_path} to {format.upper()} in {out_path}")
+    start = time.perf_counter()
+    cmd = [workload.curator_binpath, "ftdc", "export", format, "--input", ftdc_path]
+    _run_curator_export(cmd, out_path, workload.conversion_compression)
+    elapsed = time.perf_counter() - start
+
+    dirpath = os.path.dirname(ftdc_path)
+    output = os.path.basename(out_path)
+    if manifest_record is not None:
+        save_record(dirpath, output, manifest_record)
+    else:
+        record_output(dirpath, output, [os.path.basename(ftdc_path)], _ftdc_conversion_version(workload))
+    in_mb = os.path.getsize(ftdc_path) / (1 << 20)
+    out_mb = os.path.getsize(out_path) / (1 << 20)
+    log(f"Converted {ftdc_path}: {in_mb:.1f} MiB of FTDC to {out_mb:.1f} MiB of {format.upper()} in "
+        f"{elapsed:.1f}s, {out_mb / max(elapsed, 1e-6):.1f} MiB/sec written")
+    return out_path, in_mb, out_mb, elapsed
 
 def _ftdc_to_json(workload, ftdc_path):
-    json_path = ftdc_path + ".json"
+    json_path = get_conversion_path(workload, ftdc_path, "json")
     if os.path.exists(json_path):
         print(f"Skipping conversion of {ftdc_path} as {json_path} already exists")
-        return json_path
-    print(f"Converting {ftdc_path} to JSON in {json_path}")
-    fstream = open(json_path, "w", 1)
-    cmd = [workload.curator_binpath, "ftdc", "export", "json", "--input", ftdc_path]
-    proc = subprocess.Popen(cmd, stdout=fstream)
-    proc.wait()
-    fstream.close()
-    return json_path
+        return None
+    return _convert_ftdc(workload, ftdc_path, "json")
 
 def _ftdc_to_csv(workload, ftdc_path):
-    csv_path = ftdc_path + ".csv"
+    csv_path = get_conversion_path(workload, ftdc_path, "csv")
     if os.path.exists(csv_path):
         print(f"Skipping conversion of {ftdc_path} as {csv_path} already exists")
-        return csv_path
-    print(f"Converting {ftdc_path} to CSV in {csv_path}")
-    fstream = open(csv_path, "w", 1)
-    cmd = [workload.curator_binpath, "ftdc", "export", "csv", "--input", ftdc_path]
-    proc = subprocess.Popen(cmd, stdout=fstream)
-    proc.wait()
-    fstream.close()
-    return csv_path
+        return None
+    return _convert_ftdc(workload, ftdc_path, "csv")
+
+def update_stale_ftdc_conversions(workload, task_execution):
+    # Converts the execution's FTDC files to JSON, and refreshes the JSON and
+    # CSV conversions whose FTDC file or curator changed since they were made
+    if workload.genny_metrics is None or workload.curator_binpath is None:
+        return
+    dirpath = get_output_dir(workload, task_execution)
+    for test_name in workload.genny_metrics.tests:
+        if not os.path.isfile(os.path.join(dirpath, test_name)):
+            continue
+        for format in ["json", "csv"]:
+            output = os.path.basename(get_conversion_path(workload, test_name, format))
+            # CSV conversions are only kept up to date, not made
+            if format == "csv" and not os.path.isfile(os.path.join(dirpath, output)):
+                continue
+            record = get_stale_record(dirpath, output, [test_name], _ftdc_conversion_version(workload))
+            if record is not None:
+                _convert_ftdc(workload, os.path.join(dirpath, test_name), format, record)
+
+def _ftdc_paths(workload):
+    paths = []
+    for patch in workload.patches:
+        for task in patch.task_executions:
+            for x in range(task.execution + 1):
+                execution = task.get_execution(x)
+                if execution is None:
+                    continue
+                destdir = get_output_dir(workload, execution)
+                for test_name in workload.genny_metrics.tests:
+                    path = os.path.join(destdir, test_name)
+                    if os.path.isfile(path):
+                        paths.append(path)
+    return paths
 
 def convert_ftdc_files(workload, format):
     if workload.genny_metrics is None:
@@ -116,21 +273,25 @@ def convert_ftdc_files(workload, format):
         raise Exception(f"Must specify a path to the curator binary in config YAML to convert ftdc to ${format}")
     print(f"curator is {workload.curator_binpath}")
 
-    pool = ThreadPool(None)
+    # Up to conversion_workers conversions run at once, as many as fit in
+    # the memory budget. The failures are reported once the rest have run.
+    paths = _ftdc_paths(workload)
     func = _ftdc_to_csv if format == "csv" else _ftdc_to_json
-    try:
-        for patch in workload.patches:
-            for task in patch.task_executions:
-                for x in range(task.execution + 1):
-                    execution = task.get_execution(x)
-                    destdir = get_output_dir(workload, execution)
-                    if os.path.isdir(destdir):
-                        for test_name in workload.genny_metrics.tests:
-                            path = os.path.join(destdir, test_name)
-                            if os.path.isfile(path):
-                                pool.apply_async(func, (workload, path))
-    except:
-        pass
-    finally:
-        pool.close()
-        pool.join()
+    costs = [os.path.getsize(x) * CONVERSION_MEMORY_PER_FTDC_BYTE for x in paths]
+    start = time.perf_counter()
+    results, errors = run_with_budget(func, [(workload, x) for x in paths], costs,
+        workload.conversion_memory_mb << 20, workload.conversion_workers)
+    elapsed = time.perf_counter() - start
+
+    converted = [x for x in results if x is not None]
+    in_mb = sum(x[1] for x in converted)
+    out_mb = sum(x[2] for x in converted)
+    print(f"Converted {len(converted)} of {len(paths)} FTDC files, {len(paths) - len(converted) - len(errors)} "
+          f"already converted, {len(errors)} failed: {in_mb:.1f} MiB to {out_mb:.1f} MiB in {elapsed:.1f}s")
+    for out_path, file_in_mb, file_out_mb, file_elapsed in sorted(converted, key=lambda x: -x[3]):
+        print(f"  {file_elapsed:8.1f}s {file_in_mb:10.1f} MiB {file_out_mb:10.1f} MiB "
+              f"{file_out_mb / max(file_elapsed, 1e-6):8.1f} MiB/sec  {out_path}")
+    for (_, path), error in errors:
+        print(f"Failed to convert {path}:\n{error}", file=sys.stderr)
+    if errors:
+        raise Exception(f"{len(errors)} of {len(paths)} FTDC conversions failed")
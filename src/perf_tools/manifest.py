@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import threading
+
+# Each execution directory keeps a manifest of the outputs built in it: for
+# each output, the version of the code that built it and the size, mtime and
+# SHA-256 of every input it was built from. An output is stale once it is
+# missing, its builder's version changes, or an input's content changes. A
+# file whose size and mtime match the manifest isn't hashed again. Outputs
+# built from something that isn't kept on disk, such as a streamed artifact,
+# also record that source (e.g. its URL), and are stale once it changes.
+MANIFEST_FILENAME = "manifest.json"
+HASH_CHUNK_SIZE = 1 << 20
+# Serializes the read-modify-write of manifests by concurrent conversions
+_manifest_lock = threading.Lock()
+
+def _manifest_path(dirpath):
+    return os.path.join(dirpath, MANIFEST_FILENAME)
+
+def load_manifest(dirpath):
+    try:
+        with open(_manifest_path(dirpath), "r") as fstream:
+            return json.load(fstream)
+    except (OSError, ValueError):
+        return {}
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fstream:
+        for chunk in iter(lambda: fstream.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _input_record(dirpath, relpath, previous):
+    path = os.path.join(dirpath, relpath)
+    if not os.path.isfile(path):
+        return None
+    st = os.stat(path)
+    if previous and previous["size"] == st.st_size and previous["mtime_ns"] == st.st_mtime_ns:
+        return previous
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": _file_sha256(path)}
+
+def _make_record(dirpath, inputs, version, previous_inputs, source=None):
+    record = {"version": version,
+        "inputs": {x: _input_record(dirpath, x, previous_inputs.get(x)) for x in inputs}}
+    if source is not None:
+        record["source"] = source
+    return record
+
+def _input_hashes(record_inputs):
+    return {x: y and y["sha256"] for x, y in record_inputs.items()}
+
+def get_stale_record(dirpath, output, inputs, version, source=None):
+    # Returns None if output (a path relative to dirpath) is up to date with
+    # the inputs (paths relative to dirpath), the source and the builder
+    # version. Otherwise returns the record to pass to save_record once
+    # output has been rebuilt.
+    previous = load_manifest(dirpath).get(output, {})
+    previous_inputs = previous.get("inputs", {})
+    record = _make_record(dirpath, inputs, version, previous_inputs, source)
+    if not os.path.isfile(os.path.join(dirpath, output)):
+        return record
+    if previous.get("version") != version or previous.get("source") != source:
+        return record
+    if _input_hashes(record["inputs"]) != _input_hashes(previous_inputs):
+        return record
+    if record["inputs"] != previous_inputs:
+        # Only the mtimes changed: remember them to skip hashing next time
+        save_record(dirpath, output, record)
+    return None
+
+def save_record(dirpath, output, record):
+    with _manifest_lock:
+        manifest = load_manifest(dirpath)
+        manifest[output] = record
+        path = _manifest_path(dirpath)
+        part_path = f"{path}.part-{os.getpid()}"
+        with open(part_path, "w") as fstream:
+            json.dump(manifest, fstream, indent=1)
+        os.replace(part_path, path)
+
+def record_output(dirpath, output, inputs, version, source=None):
+    # Records that output was just built from the current inputs and source
+    previous_inputs = load_manifest(dirpath).get(output, {}).get("inputs", {})
+    save_record(dirpath, output, _make_record(dirpath, inputs, version, previous_inputs, source))
@@ -0,0 +1,128 @@
+import io
+import sys
+import threading
+import traceback
+
+from contextlib import redirect_stdout
+
+# Pools that iterate_executions can run its callback in: threads for I/O
+# bound callbacks (downloads, printing CSVs), processes for CPU bound ones
+# (parsing logs).
+POOL_KINDS = ["threads", "processes"]
+
+class _PerThreadStdout:
+    # Sends the output of each worker thread to that thread's own buffer, and
+    # everything else to the real stdout.
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, "buffer", None) or self.stdout
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        # Everything else (fileno, encoding, isatty, buffer...) is the real
+        # stdout's, for the code that needs an actual file
+        return getattr(self.stdout, name)
+
+def _call_capturing_output(func, args):
+    # Runs func(*args), returning what it printed and the traceback of the
+    # exception it raised, if any
+    output = io.StringIO()
+    error = None
+    with redirect_stdout(output):
+        try:
+            func(*args)
+        except Exception:
+            error = traceback.format_exc()
+    return output.getvalue(), error
+
+def _call_in_thread(stdout, func, args):
+    output = io.StringIO()
+    stdout.local.buffer = output
+    error = None
+    try:
+        func(*args)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        stdout.local.buffer = None
+    return output.getvalue(), error
+
+def run_in_pool(func, args_list, pool_kind, max_workers):
+    # Calls func(*args) for each args in args_list with up to max_workers
+    # calls in flight. The output of each call is printed as one block, in the
+    # order of args_list, once it and the calls before it have finished. A
+    # failing call doesn't stop the others: the tracebacks are returned as a
+    # list of (args, traceback) pairs.
+    errors = []
+    if pool_kind == "processes":
+        # Imported here, as it loads multiprocessing, which the commands that
+        # only use threads don't need
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = pool.map(_call_capturing_output, [func] * len(args_list), args_list)
+            for args, (output, error) in zip(args_list, results):
+                sys.stdout.write(output)
+                if error is not None:
+                    errors.append((args, error))
+    elif pool_kind == "threads":
+        from concurrent.futures import ThreadPoolExecutor
+        stdout = _PerThreadStdout(sys.stdout)
+        sys.stdout = stdout
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                results = pool.map(lambda args: _call_in_thread(stdout, func, args), args_list)
+                for args, (output, error) in zip(args_list, results):
+                    stdout.stdout.write(output)
+                    stdout.stdout.flush()
+                    if error is not None:
+                        errors.append((args, error))
+        finally:
+            sys.stdout = stdout.stdout
+    else:
+        raise Exception(f"Unknown pool kind: {pool_kind}")
+    return errors
+
+def run_with_budget(func, args_list, costs, budget, max_workers):
+    # Calls func(*args) for each args in args_list, in order, in up to
+    # max_workers threads, starting a call only once the costs of the calls
+    # in flight leave room for its own within budget. A call costing more
+    # than the whole budget runs on its own. Returns the results in the order
+    # of args_list, None for the calls that raised, and the (args, traceback)
+    # pairs of those calls.
+    from concurrent.futures import ThreadPoolExecutor
+    condition = threading.Condition()
+    in_use = [0]
+
+    def call(args, cost):
+        try:
+            return func(*args), None
+        except Exception:
+            return None, traceback.format_exc()
+        finally:
+            with condition:
+                in_use[0] -= cost
+                condition.notify_all()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for args, cost in zip(args_list, costs):
+            with condition:
+                condition.wait_for(lambda: in_use[0] == 0 or in_use[0] + cost <= budget)
+                in_use[0] += cost
+            futures.append(pool.submit(call, args, cost))
+    results = []
+    errors = []
+    for args, future in zip(args_list, futures):
+        result, error = future.result()
+        results.append(result)
+        if error is not None:
+            errors.append((args, error))
+    return results, errors
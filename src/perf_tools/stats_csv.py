@@ -0,0 +1,81 @@
+import json
+
+DEFAULT_METRICS = [ "Patch ID", "Execution", "Task Name", "Topology", "Test" ]
+DEFAULT_STORAGE_METRICS = DEFAULT_METRICS + [ "Node" ]
+
+def _check_headers_include_defaults(headers, defaults):
+    missing = []
+    for hdr in defaults:
+        if hdr not in headers:
+            missing.append('"' + hdr + '"')
+    if missing:
+        raise Exception("Headers list must include the following: [" + ",".join(missing) + "]")
+
+# The columns filled from each Cedar result's "info" object
+INFO_COLUMNS = [("Patch ID", "version"), ("Execution", "execution"), ("Task Name", "task_name"),
+    ("Topology", "variant"), ("Test", "test_name")]
+
+def _flatten_results(json_obj):
+    # The result objects of a Cedar response, in order, from any nesting of
+    # lists
+    results = []
+    stack = [iter([json_obj])]
+    while stack:
+        for obj in stack[-1]:
+            if isinstance(obj, list):
+                stack.append(iter(obj))
+                break
+            if isinstance(obj, dict):
+                results.append(obj)
+        else:
+            stack.pop()
+    return results
+
+class StatsExtractor:
+    # Extracts a table with the given headers from Cedar responses: a row for
+    # each result of one of the tests, holding its info fields and the values
+    # of the selected metrics in its rollups. The header -> column lookups
+    # and the test and metric filters are worked out once, here.
+    def __init__(self, tests, headers, default_metrics):
+        _check_headers_include_defaults(headers, default_metrics)
+        self.headers = list(dict.fromkeys(headers))
+        self.tests = set(tests)
+        index = {hdr: i for i, hdr in enumerate(self.headers)}
+        self.info_columns = [(index[hdr], key) for hdr, key in INFO_COLUMNS]
+        self.node_column = index["Node"] if "Node" in default_metrics else None
+        self.metric_columns = {hdr: i for hdr, i in index.items() if hdr not in default_metrics}
+
+    def extract(self, json_obj):
+        # Returns the table as a dict of header -> column, and the number of
+        # results of the tests that were skipped, by reason
+        results = _flatten_results(json_obj)
+        columns = [[None] * len(results) for _ in self.headers]
+        skipped = {"no rollups": 0, "malformed": 0}
+        row = 0
+        for obj in results:
+            try:
+                info = obj["info"]
+                if info["test_name"] not in self.tests:
+                    continue
+                stats = (obj.get("rollups") or {}).get("stats")
+                if not isinstance(stats, list):
+                    skipped["no rollups"] += 1
+                    continue
+                for i, key in self.info_columns:
+                    columns[i][row] = info[key]
+                if self.node_column is not None:
+                    args = info.get("args")
+                    columns[self.node_column][row] = json.dumps(args) if isinstance(args, dict) else None
+                for stat in stats:
+                    i = self.metric_columns.get(stat["name"])
+                    if i is not None:
+                        columns[i][row] = stat["val"]
+            except (KeyError, TypeError):
+                skipped["malformed"] += 1
+                for column in columns:
+                    column[row] = None
+                continue
+            row += 1
+        for column in columns:
+            del column[row:]
+        return dict(zip(self.headers, columns)), skipped
@@ -1,15 +1,45 @@
-import yaml
+import os
+import sys
 
-from evergreen.api import EvergreenApi
-from evergreen.config import get_auth
+from evergreen_cache import EVERGREEN_CACHE_DIR, build_listing, task_info, is_task_completed
+from evergreen_cache import load_version_cache, save_version_cache
+from fetch import DEFAULT_MAX_WORKERS, map_concurrently
+from parallel import POOL_KINDS, run_in_pool
+from stats_csv import DEFAULT_METRICS, DEFAULT_STORAGE_METRICS, StatsExtractor
+from writer import TABLE_FORMATS
 
-from csv import DEFAULT_METRICS, DEFAULT_STORAGE_METRICS
-from csv import get_summary_stats_as_csv, get_storage_stats_as_csv
+CEDAR_URL = "https://cedar.mongodb.com/rest/v1"
+EXPORT_DIR = "dataset"
+DEFAULT_CONVERSION_MEMORY_MB = 4096
+# How the ftdc_to_json and ftdc_to_csv outputs can be compressed
+CONVERSION_COMPRESSIONS = ["none", "gzip", "zstd"]
+# How fetch_artifacts unpacks DSI artifacts:
+#   full       download the tarball, then extract all of it
+#   selective  download the tarball, then extract only the logs the YCSB
+#              postprocessors read
+#   streaming  extract only those logs while the tarball downloads, without
+#              saving the tarball
+#   parse      parse those logs while the tarball downloads and write the
+#              YCSB stats CSVs, without extracting anything
+ARTIFACT_EXTRACTION_MODES = ["full", "selective", "streaming", "parse"]
+
+class LazyEvergreenApi:
+    # Stands in for the Evergreen API client, which is only created (and
+    # evergreen.py imported, and the credentials read) on first use, so the
+    # commands that are served from the Evergreen cache start quickly
+    def __init__(self):
+        self.api = None
+
+    def __getattr__(self, name):
+        if self.api is None:
+            from evergreen.api import EvergreenApi
+            from evergreen.config import get_auth
+            self.api = EvergreenApi.get_api(get_auth())
+        return getattr(self.api, name)
 
 class TestAndMetrics:
-    def __init__(self, cfg_node, yaml_name, default_metrics, csv_func):
+    def __init__(self, cfg_node, yaml_name, default_metrics):
         self.yaml_name = yaml_name
-        self.csv_func = csv_func
         self.default_metrics = default_metrics
         metrics_node = cfg_node[yaml_name]
         assert "tests" in metrics_node
@@ -22,60 +52,139 @@ class TestAndMetrics:
             assert isinstance(v, str)
         for v in self.selected_metrics:
             assert isinstance(v, str)
+        self.extractor = StatsExtractor(self.tests, self.get_all_headers(), default_metrics)
 
     def get_all_headers(self):
         return self.default_metrics + self.selected_metrics
 
-    def get_stats_as_csv(self, json_obj, headers, csv_dict):
-        self.csv_func(json_obj, self.tests, headers, csv_dict)
+    def get_stats_as_csv(self, json_obj):
+        # Returns the stats of a Cedar response as a dict of header -> column,
+        # and the number of results skipped, by reason
+        return self.extractor.extract(json_obj)
+
+def _is_listing_settled(builds, tasks, patch_cfg):
+    # Whether every task named in patch_cfg is listed, cached and completed.
+    # Until then, tasks may still be activated or restarted, which only a
+    # fresh build listing shows.
+    for build_variant, names in patch_cfg.items():
+        build = builds.get(build_variant)
+        if build is None:
+            return False
+        listed = {name: task_id for task_id, name in build["tasks"]}
+        for name in names:
+            task_id = listed.get(name)
+            if task_id not in tasks or not is_task_completed(tasks[task_id]):
+                return False
+    return True
 
 class Patch:
-    def __init__(self, workload_name, patch_id, patch_cfg, api):
+    def __init__(self, workload_name, patch_id, patch_cfg, api, cache_dir, refresh=False,
+            max_workers=DEFAULT_MAX_WORKERS):
+        # api is None when offline, in which case everything must come from
+        # the cache in cache_dir. Completed tasks are served from the cache,
+        # and the build listing too once all of the selected tasks have
+        # completed; refresh fetches everything again.
         self.patch_id = patch_id
         self.task_executions = []
         self.workload_name = workload_name
 
+        builds, tasks = (None, {}) if refresh else load_version_cache(cache_dir, patch_id)
+        fetched = set()
+        updated = False
+        if builds is not None and api is not None and not _is_listing_settled(builds, tasks, patch_cfg):
+            builds = None
+
         # get the build info
-        builds = api.builds_by_version(patch_id)
+        if builds is None:
+            self._check_online(api, cache_dir)
+            builds = {x.build_variant: build_listing(x) for x in api.builds_by_version(patch_id)}
+            updated = True
+
         # filter by the selected build variants
-        filtered_builds = [x for x in builds if x.build_variant in patch_cfg]
+        filtered_builds = [(k, v) for k, v in builds.items() if k in patch_cfg]
+
+        # Tasks are selected by the display names in the build listings, so
+        # only the tasks named in the config are fetched. A build listed
+        # without task names has all of its tasks fetched in one request.
+        for build_variant, build in filtered_builds:
+            if any(name is None and task_id not in tasks for task_id, name in build["tasks"]):
+                self._check_online(api, cache_dir)
+                for task in api.tasks_by_build(build["id"], fetch_all_executions=True):
+                    tasks[task.task_id] = task_info(task)
+                    fetched.add(task.task_id)
+            for listed in build["tasks"]:
+                if listed[1] is None and listed[0] in tasks:
+                    listed[1] = tasks[listed[0]].display_name
+                    updated = True
+
+        wanted = [task_id for build_variant, build in filtered_builds
+            for task_id, name in build["tasks"] if name in patch_cfg[build_variant]]
+        stale = [task_id for task_id in wanted if task_id not in fetched and
+            (task_id not in tasks or (api is not None and not is_task_completed(tasks[task_id])))]
+        if stale:
+            self._check_online(api, cache_dir)
+            fresh = map_concurrently(lambda task_id: task_info(api.task_by_id(task_id, fetch_all_executions=True)),
+                stale, max_workers)
+            tasks.update(zip(stale, fresh))
+            fetched.update(stale)
+
+        self.task_executions = [tasks[task_id] for task_id in wanted]
 
-        for build in filtered_builds:
-            for task_id in build.tasks:
-                task = api.task_by_id(task_id, fetch_all_executions=True)
-                if task.display_name in patch_cfg[build.build_variant]:
-                    self.task_executions.append(task)
+        if updated or fetched:
+            save_version_cache(cache_dir, patch_id, builds, tasks)
+
+    def _check_online(self, api, cache_dir):
+        if api is None:
+            raise Exception(f"Patch {self.patch_id} isn't fully cached in {cache_dir}; "
+                            f"run refresh_evergreen_cache without offline set first")
 
     def iterate_executions(self, workload, callback):
-        for task in self.task_executions:
-            for x in range(task.execution + 1):
-                execution = task.get_execution(x)
-                callback(workload, execution)
+        for execution in self.all_executions():
+            callback(workload, execution)
+
+    def all_executions(self):
+        return [execution for task in self.task_executions for execution in task.executions]
 
     def iterate_tasks(self, workload, callback):
         for task in self.task_executions:
             callback(workload, task)
 
 class WorkloadConfig:
-    def __init__(self, cfgfile):
+    def __init__(self, cfgfile, refresh=False):
         self.workload_name=""
         self.patches_cfg={}
         self.patches=[]
 
         self.curator_binpath=None
+        self.cedar_url=CEDAR_URL
+        self.max_workers=DEFAULT_MAX_WORKERS
+        self.artifact_extraction="full"
+        self.parallel_executions=False
+        self.evergreen_cache_dir=EVERGREEN_CACHE_DIR
+        self.offline=False
+        self.export_dir=EXPORT_DIR
+        self.output_format="csv"
+        self.conversion_workers=os.cpu_count() or 1
+        self.conversion_memory_mb=DEFAULT_CONVERSION_MEMORY_MB
+        self.conversion_compression="none"
         self.genny_metrics=None
         self.storage_metrics=None
         self.timing_metrics=None
 
         self._parse_config(cfgfile)
-        self.evgauth = get_auth()
-        # print("Auth: " + self.evgauth.username + ", " + self.evgauth.api_key)
-        self.evgapi = EvergreenApi.get_api(self.evgauth)
+        self.evgapi = None
+        if self.offline:
+            if refresh:
+                raise Exception(f"Can't refresh the Evergreen cache with offline set in {cfgfile}")
+        else:
+            self.evgapi = LazyEvergreenApi()
 
         for patch_id, patch_cfg in self.patches_cfg.items():
-            self.patches.append(Patch(self.workload_name, patch_id, patch_cfg, self.evgapi))
+            self.patches.append(Patch(self.workload_name, patch_id, patch_cfg, self.evgapi,
+                self.evergreen_cache_dir, refresh, self.max_workers))
 
     def _parse_config(self, cfgfile):
+        import yaml
         with open(cfgfile, "r") as fstream:
             y = yaml.safe_load(fstream)
             self.workload_name = y["workload_name"]
@@ -84,19 +193,81 @@ class WorkloadConfig:
             assert isinstance(self.patches_cfg, dict)
 
             if "genny_metrics" in y:
-                self.genny_metrics = TestAndMetrics(y, "genny_metrics", DEFAULT_METRICS, get_summary_stats_as_csv)
+                self.genny_metrics = TestAndMetrics(y, "genny_metrics", DEFAULT_METRICS)
             if "storage_metrics" in y:
-                self.storage_metrics = TestAndMetrics(y, "storage_metrics", DEFAULT_STORAGE_METRICS, get_storage_stats_as_csv)
+                self.storage_metrics = TestAndMetrics(y, "storage_metrics", DEFAULT_STORAGE_METRICS)
             if "timing_metrics" in y:
-                self.timing_metrics = TestAndMetrics(y, "timing_metrics", DEFAULT_METRICS, get_summary_stats_as_csv)
+                self.timing_metrics = TestAndMetrics(y, "timing_metrics", DEFAULT_METRICS)
             if "curator" in y:
                 self.curator_binpath = y["curator"]
                 assert isinstance(self.curator_binpath, str)
+            if "cedar_url" in y:
+                self.cedar_url = y["cedar_url"]
+                assert isinstance(self.cedar_url, str)
+            if "max_workers" in y:
+                self.max_workers = y["max_workers"]
+                assert isinstance(self.max_workers, int) and self.max_workers > 0
+            if "artifact_extraction" in y:
+                self.artifact_extraction = y["artifact_extraction"]
+                assert self.artifact_extraction in ARTIFACT_EXTRACTION_MODES
+            if "parallel_executions" in y:
+                self.parallel_executions = y["parallel_executions"]
+                assert isinstance(self.parallel_executions, bool)
+            if "evergreen_cache_dir" in y:
+                self.evergreen_cache_dir = y["evergreen_cache_dir"]
+                assert isinstance(self.evergreen_cache_dir, str)
+            if "export_dir" in y:
+                self.export_dir = y["export_dir"]
+                assert isinstance(self.export_dir, str)
+            if "output_format" in y:
+                self.output_format = y["output_format"]
+                assert self.output_format in TABLE_FORMATS
+            if "conversion_workers" in y:
+                self.conversion_workers = y["conversion_workers"]
+                assert isinstance(self.conversion_workers, int) and self.conversion_workers > 0
+            if "conversion_memory_mb" in y:
+                self.conversion_memory_mb = y["conversion_memory_mb"]
+                assert isinstance(self.conversion_memory_mb, int) and self.conversion_memory_mb > 0
+            if "conversion_compression" in y:
+                self.conversion_compression = y["conversion_compression"]
+                assert self.conversion_compression in CONVERSION_COMPRESSIONS
+            if "offline" in y:
+                self.offline = y["offline"]
+                assert isinstance(self.offline, bool)
 
-    def iterate_executions(self, callback):
-        for p in self.patches:
-            p.iterate_executions(self, callback)
+    def __getstate__(self):
+        # Worker processes only need the parsed config, not the API client
+        # or the tasks it fetched
+        state = self.__dict__.copy()
+        state["evgapi"] = None
+        state["patches"] = []
+        return state
+
+    def iterate_executions(self, callback, pool_kind="threads"):
+        # Calls callback(self, execution) for every task execution. With
+        # parallel_executions set, the calls run concurrently in a pool of
+        # max_workers threads or processes: their output is still printed in
+        # execution order, and a failing execution is reported once the rest
+        # have run rather than stopping them.
+        if not self.parallel_executions:
+            for p in self.patches:
+                p.iterate_executions(self, callback)
+            return
+
+        assert pool_kind in POOL_KINDS
+        executions = self.all_executions()
+        errors = run_in_pool(callback, [(self, x) for x in executions], pool_kind, self.max_workers)
+        for (_, execution), error in errors:
+            print(f"Failed on {execution.task_id} execution {execution.execution}:\n{error}", file=sys.stderr)
+        if errors:
+            raise Exception(f"{len(errors)} of {len(executions)} task executions failed")
 
     def iterate_tasks(self, callback):
         for p in self.patches:
             p.iterate_tasks(self, callback)
+
+    def all_tasks(self):
+        return [task for p in self.patches for task in p.task_executions]
+
+    def all_executions(self):
+        return [execution for p in self.patches for execution in p.all_executions()]
@@ -0,0 +1,158 @@
+import json
+
+# Formats a TableWriter can write. Tables are passed around as a dict of
+# header -> list of column values (None for a missing value), like the ones
+# built by stats_csv.
+TABLE_FORMATS = ["csv", "ndjson", "parquet"]
+
+# Rows are formatted and written this many at a time
+WRITE_BATCH_ROWS = 1 << 16
+# CSV tables with at least this many rows are formatted with Arrow; below
+# it, importing pyarrow costs more than it saves
+ARROW_CSV_MIN_ROWS = 1 << 16
+
+def _row_batches(csv_dict, headers):
+    nrows = len(csv_dict[headers[0]]) if headers else 0
+    for start in range(0, nrows, WRITE_BATCH_ROWS):
+        yield [csv_dict[hdr][start:start + WRITE_BATCH_ROWS] for hdr in headers]
+
+def _needs_quoting(text):
+    return "," in text or '"' in text or "\n" in text or "\r" in text
+
+def _csv_quote(field):
+    # Quotes a field like csv.writer with QUOTE_MINIMAL does
+    if _needs_quoting(field):
+        return '"' + field.replace('"', '""') + '"'
+    return field
+
+def _csv_column(values):
+    # Formats a column at a time: one str() per value, and a single scan of
+    # the whole column to decide whether any field needs quoting
+    if None in values:
+        fields = ["" if v is None else str(v) for v in values]
+    else:
+        fields = list(map(str, values))
+    if _needs_quoting("".join(fields)):
+        fields = list(map(_csv_quote, fields))
+    return fields
+
+def _csv_lines(columns):
+    columns = [_csv_column(values) for values in columns]
+    return "".join(",".join(row) + "\n" for row in zip(*columns))
+
+
+def _arrow_float_column(values):
+    # Formats a float column with Arrow's cast, which finds the same
+    # shortest round-tripping digits as str() many times faster, then lays
+    # them out as str() does: positional from 1e-4 up to 1e16 with a ".0"
+    # on integral values, and a two-digit exponent otherwise. The few values
+    # Arrow lays out differently (e.g. 1e+15, nan) fall back to str().
+    import numpy as np
+    import pyarrow
+    import pyarrow.compute as pc
+
+    floats = np.array(values, dtype=float)
+    # None becomes nan, so only the nan values need checking
+    nulls = np.isnan(floats)
+    for i in np.flatnonzero(nulls):
+        nulls[i] = values[i] is None
+    text = pc.cast(pyarrow.array(floats, mask=nulls), pyarrow.string())
+    finite = np.isfinite(floats)
+    absolute = np.abs(floats)
+    str_exponent = finite & ((absolute >= 1e16) | ((absolute < 1e-4) & (floats != 0)))
+    arrow_exponent = pc.fill_null(pc.match_substring(text, "e"), False).to_numpy(zero_copy_only=False)
+    positional = finite & ~str_exponent & ~arrow_exponent
+    exponent = str_exponent & arrow_exponent
+    if exponent.any():
+        text = pc.if_else(pyarrow.array(exponent), pc.replace_substring_regex(text, r"e([+-])(\d)$", r"e\10\2"), text)
+    integral = positional & (floats == np.trunc(floats))
+    if integral.any():
+        text = pc.if_else(pyarrow.array(integral), pc.binary_join_element_wise(text, ".0", ""), text)
+    fallback = ~(positional | exponent | nulls)
+    if fallback.any():
+        fields = [None] * len(values)
+        for i in np.flatnonzero(fallback):
+            fields[i] = str(values[i])
+        text = pc.if_else(pyarrow.array(fallback), pyarrow.array(fields, pyarrow.string()), text)
+    return pc.fill_null(text, "")
+
+def _arrow_str_column(values):
+    import pyarrow
+    import pyarrow.compute as pc
+
+    text = pyarrow.array(values, pyarrow.string())
+    quote = pc.match_substring_regex(text, '[,"\r\n]')
+    if pc.any(quote).as_py():
+        quoted = pc.binary_join_element_wise('"', pc.replace_substring(text, '"', '""'), '"', "")
+        text = pc.if_else(quote, quoted, text)
+    return pc.fill_null(text, "")
+
+def _arrow_csv_column(values):
+    import pyarrow
+
+    types = set(map(type, values)) - {type(None)}
+    if types <= {float}:
+        return _arrow_float_column(values)
+    if types <= {str}:
+        return _arrow_str_column(values)
+    return pyarrow.array(_csv_column(values), pyarrow.string())
+
+def _arrow_csv_lines(columns):
+    # Same output as _csv_lines, with float and str columns formatted a
+    # column at a time and the rows joined by Arrow instead of one join()
+    # per row
+    import numpy as np
+    import pyarrow.compute as pc
+
+    columns = list(map(_arrow_csv_column, columns))
+    lines = pc.binary_join_element_wise(pc.binary_join_element_wise(*columns, ","), "\n", "")
+    offsets = np.frombuffer(lines.buffers()[1], dtype=np.int32)[lines.offset:lines.offset + len(lines) + 1]
+    return str(memoryview(lines.buffers()[2])[offsets[0]:offsets[-1]], "utf-8")
+
+def _ndjson_lines(headers, columns):
+    return "".join(json.dumps(dict(zip(headers, row))) + "\n" for row in zip(*columns))
+
+class TableWriter:
+    # Writes tables with the given headers to fstream, which is a text
+    # stream for csv and ndjson and a binary stream for parquet. CSV values
+    # are quoted where needed, so values containing commas (such as the JSON
+    # in the Node column) stay in their column. CSV and NDJSON rows are
+    # written as each table arrives; Parquet rows are written on close(), as
+    # a single row group.
+    def __init__(self, fstream, headers, format="csv", include_headers=True):
+        assert format in TABLE_FORMATS
+        self.fstream = fstream
+        self.headers = headers
+        self.format = format
+        self.columns = {hdr: [] for hdr in headers}
+        if format == "csv" and include_headers:
+            fstream.write(",".join(map(_csv_quote, headers)) + "\n")
+
+    def write(self, csv_dict):
+        if self.format == "csv":
+            nrows = len(csv_dict[self.headers[0]]) if self.headers else 0
+            csv_lines = _arrow_csv_lines if nrows >= ARROW_CSV_MIN_ROWS else _csv_lines
+            for columns in _row_batches(csv_dict, self.headers):
+                self.fstream.write(csv_lines(columns))
+        elif self.format == "ndjson":
+            for columns in _row_batches(csv_dict, self.headers):
+                self.fstream.write(_ndjson_lines(self.headers, columns))
+        else:
+            for hdr in self.headers:
+                self.columns[hdr].extend(csv_dict[hdr])
+
+    def close(self):
+        if self.format == "parquet":
+            # Imported here, as pyarrow is slow to load and only needed for
+            # Parquet
+            import pyarrow
+            import pyarrow.parquet
+
+            table = pyarrow.table({hdr: pyarrow.array(self.columns[hdr]) for hdr in self.headers})
+            pyarrow.parquet.write_table(table, self.fstream)
+        self.fstream.flush()
+
+def write_table(fstream, csv_dict, headers, format="csv", include_headers=True):
+    writer = TableWriter(fstream, headers, format, include_headers)
+    writer.write(csv_dict)
+    writer.close()
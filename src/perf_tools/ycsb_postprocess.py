@@ -1,11 +1,15 @@
-
+import mmap
 import os
+import re
+import shutil
 import subprocess
 
-from contextlib import redirect_stdout
 from pathlib import Path
 
-from csv import print_csv
+from fetch import make_session, download_to_file, open_url_stream
+from fetch import iter_tarball_members, extract_tarball_members, stream_extract_tarball
+from manifest import get_stale_record, record_output, save_record
+from writer import write_table
 
 YCSB_SUMMARY_STATS_CSV_FILENAME="perf_data.csv"
 YCSB_WC_STATS_CSV_FILENAME="wc_data.csv"
@@ -22,6 +26,10 @@ SUMMARY_STATS_HEADERS=[
     "Update 99thPercentileLatency(us)"
 ]
 WC_STATS_HEADERS=["Patch ID", "Execution", "Task Name", "Topology"] + YCSB_DIRS
+# Bump these when the way the stats are computed changes, so that the update
+# command rebuilds the CSVs
+SUMMARY_STATS_VERSION=1
+WC_STATS_VERSION=1
 
 def get_output_dir(workload, task_execution):
     return os.path.join(workload.workload_name, task_execution.version_id, task_execution.build_variant,
@@ -32,49 +40,276 @@ def setup_output_dir(workload, task_execution):
     Path(path).mkdir(parents=True, exist_ok=True)
     return path
 
+# Paths, relative to an execution's output directory, of the logs that the
+# summary stats and write conflict stats postprocessors read.
+def summary_stats_log_path(phase):
+    return os.path.join("WorkloadOutput", "reports", phase, "test_output.log")
+
+def wc_stats_log_paths(phase, sharded):
+    nodes = ["mongod.0", "mongod.2"] if sharded else ["mongod.0"]
+    return [os.path.join("WorkloadOutput", "reports", phase, node, "mongod.log") for node in nodes]
+
+def summary_stats_inputs():
+    return [summary_stats_log_path(phase) for phase in YCSB_DIRS]
+
+def wc_stats_inputs(task_execution):
+    sharded = "shard" in task_execution.build_variant
+    return [path for phase in YCSB_DIRS for path in wc_stats_log_paths(phase, sharded)]
+
+# The members of a DSI artifact tarball that the postprocessors need
+YCSB_ARTIFACT_MEMBERS = set(
+    [summary_stats_log_path(phase) for phase in YCSB_DIRS] +
+    [path for phase in YCSB_DIRS for path in wc_stats_log_paths(phase, True)])
+
+def is_needed_artifact_member(name):
+    return name in YCSB_ARTIFACT_MEMBERS
+
+SUMMARY_STATS_METRICS_REGEX="(Operations|RunTime\\(ms\\)|Throughput\\(ops\\/sec\\)|(Average|Min|Max|95thPercentile|99thPercentile)Latency\\(us\\))"
+SUMMARY_STATS_PATTERN=re.compile(f"\\[(OVERALL|INSERT|READ|UPDATE)\\], {SUMMARY_STATS_METRICS_REGEX}, [0-9.]+".encode())
+# Matches at most once per line, so counting matches counts lines: [^\n]*
+# can't leave the line, and being greedy it runs to the line's last
+# "Please retry".
+WC_PATTERN=re.compile(b"WriteConflict[^\n]*Please retry your operation")
+LOG_SCAN_CHUNK_SIZE=16 << 20
+
+def _add_summary_stat(stats, match):
+    # Each match is a 3-column CSV: (eg. "[OVERALL], Operations, 100000")
+    cols = [x.strip() for x in match.split(",")]
+
+    # Combine column 0 & 1 values to a metric key (e.g "Overall Operations")
+    key = cols[0][1] + cols[0][2:len(cols[0])-1].lower() + " " + cols[1]
+    stats[key] = cols[2]
+
+def _iter_log_chunks(fstream, chunk_size=LOG_SCAN_CHUNK_SIZE):
+    # Reads a binary stream in large blocks, each cut back to its last newline
+    # so that no line straddles two chunks
+    tail = b""
+    while True:
+        block = fstream.read(chunk_size)
+        if not block:
+            break
+        end = block.rfind(b"\n") + 1
+        if end == 0:
+            tail += block
+            continue
+        yield tail + block[:end]
+        tail = block[end:]
+    if tail:
+        yield tail
+
+def _scan_log_buffer(buffer, stats):
+    # Adds the summary stats found in buffer to stats and returns its number
+    # of WriteConflict lines
+    for match in SUMMARY_STATS_PATTERN.finditer(buffer):
+        _add_summary_stat(stats, match.group(0).decode())
+    if buffer.find(b"WriteConflict") == -1:
+        return 0
+    return sum(1 for _ in WC_PATTERN.finditer(buffer))
+
+def scan_ycsb_log(fstream):
+    # One pass over a test_output.log or mongod.log, read from a binary
+    # stream: returns its summary stats and its number of WriteConflict lines
+    stats = {}
+    wc_count = 0
+    for chunk in _iter_log_chunks(fstream):
+        wc_count += _scan_log_buffer(chunk, stats)
+    return stats, wc_count
+
+def scan_ycsb_log_file(logpath):
+    # scan_ycsb_log on a file, which is mapped rather than copied into chunks
+    if not os.path.isfile(logpath):
+        return None
+    with open(logpath, "rb") as fstream:
+        if os.fstat(fstream.fileno()).st_size == 0:
+            return {}, 0
+        with mmap.mmap(fstream.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            stats = {}
+            return stats, _scan_log_buffer(buffer, stats)
+
+def _write_summary_stats_csv(csvpath, task_execution, phase_stats):
+    csv_table = {hdr: [] for hdr in SUMMARY_STATS_HEADERS}
+    for dir in YCSB_DIRS:
+        csv_row={hdr: None for hdr in SUMMARY_STATS_HEADERS}
+        csv_row["Patch ID"] = task_execution.version_id
+        csv_row["Execution"] = task_execution.execution
+        csv_row["Task Name"] = task_execution.display_name
+        csv_row["Topology"] = task_execution.build_variant
+        csv_row["Test"] = dir
+        csv_row.update(phase_stats.get(dir, {}))
+        for key, value in csv_row.items():
+            csv_table[key].append(value)
+
+    with open(csvpath, "w", newline="") as fstream:
+        write_table(fstream, csv_table, SUMMARY_STATS_HEADERS)
+
+def _write_wc_stats_csv(csvpath, task_execution, phase_counts):
+    csv_table = {hdr: [] for hdr in WC_STATS_HEADERS}
+    for phase in YCSB_DIRS:
+        csv_table[phase].append(str(phase_counts[phase]))
+
+    csv_table["Patch ID"].append(task_execution.version_id)
+    csv_table["Execution"].append(task_execution.execution)
+    csv_table["Task Name"].append(task_execution.display_name)
+    csv_table["Topology"].append(task_execution.build_variant)
+
+    with open(csvpath, "w", newline="") as fstream:
+        write_table(fstream, csv_table, WC_STATS_HEADERS)
+
+def _sum_wc_counts(log_counts, sharded):
+    # Per-phase write conflict counts, or None if any of the logs is missing
+    phase_counts = {}
+    for phase in YCSB_DIRS:
+        counts = [log_counts.get(path) for path in wc_stats_log_paths(phase, sharded)]
+        if None in counts:
+            return None
+        phase_counts[phase] = sum(counts)
+    return phase_counts
+
+def _check_found_logs(names, source):
+    # An artifact with none of the needed logs (another layout, or an
+    # incomplete upload) would otherwise yield no stats without a word
+    if not names:
+        raise Exception(f"No needed logs in {source}")
+
+def _update_stats_from_tarball(dirpath, task_execution, fileobj, source):
+    # Parses the needed logs straight out of the compressed tarball stream
+    # and writes both stats CSVs without extracting anything. Returns the
+    # names of the logs parsed; nothing is written if there are none. With
+    # no logs on disk, the CSVs are recorded in the manifest against source,
+    # the artifact's URL.
+    phase_stats = {}
+    log_counts = {}
+    names = []
+    for name, src in iter_tarball_members(fileobj, is_needed_artifact_member):
+        stats, wc_count = scan_ycsb_log(src)
+        if name.endswith("test_output.log"):
+            phase_stats[name.split(os.sep)[2]] = stats
+        else:
+            log_counts[name] = wc_count
+        names.append(name)
+    if not names:
+        return names
+
+    csvpath = os.path.join(dirpath, YCSB_SUMMARY_STATS_CSV_FILENAME)
+    print(f"Updating {csvpath}")
+    _write_summary_stats_csv(csvpath, task_execution, phase_stats)
+    record_output(dirpath, YCSB_SUMMARY_STATS_CSV_FILENAME, [], SUMMARY_STATS_VERSION, source)
+    phase_counts = _sum_wc_counts(log_counts, "shard" in task_execution.build_variant)
+    if phase_counts is None:
+        missing = [path for path in wc_stats_inputs(task_execution) if path not in log_counts]
+        print(f"Skipping {os.path.join(dirpath, YCSB_WC_STATS_CSV_FILENAME)} because of missing logs in {source}: "
+            f"{', '.join(missing)}")
+    else:
+        csvpath = os.path.join(dirpath, YCSB_WC_STATS_CSV_FILENAME)
+        print(f"Updating {csvpath}")
+        _write_wc_stats_csv(csvpath, task_execution, phase_counts)
+        record_output(dirpath, YCSB_WC_STATS_CSV_FILENAME, [], WC_STATS_VERSION, source)
+    return names
+
+def _parse_dsi_artifact(dirpath, task_execution, url):
+    session = make_session(1)
+    try:
+        with open_url_stream(session, url) as fstream:
+            names = _update_stats_from_tarball(dirpath, task_execution, fstream, url)
+    except Exception:
+        print(f"Failed to download artifact from {url}")
+        raise
+    _check_found_logs(names, url)
+
+def _dsi_artifact_url(task_execution):
+    for artifact in task_execution.artifacts:
+        if "DSI Artifacts" in artifact.name:
+            return artifact.url
+    return None
+
 def download_and_extract_dsi_artifact(workload, task_execution):
     dirpath = get_output_dir(workload, task_execution)
+    mode = workload.artifact_extraction
 
-    def _try_untar(taskdir):
+    def _try_untar(taskdir, url):
         if os.path.exists(os.path.join(taskdir, "WorkloadOutput")):
             return
         tgzfile = os.path.join(taskdir,"dsi_artifact.tgz")
-        print(f"Unpacking {tgzfile}...")
-        subprocess.run(["tar", "-C", taskdir, "-xvzf", tgzfile],
-            stdout=subprocess.PIPE, check=True)
+        if mode == "full":
+            print(f"Unpacking {tgzfile}...")
+            subprocess.run(["tar", "-C", taskdir, "-xvzf", tgzfile],
+                stdout=subprocess.PIPE, check=True)
+            return
+        if mode == "parse":
+            print(f"Parsing {tgzfile}...")
+            with open(tgzfile, "rb") as fstream:
+                names = _update_stats_from_tarball(taskdir, task_execution, fstream, url)
+        else:
+            print(f"Unpacking the logs in {tgzfile}...")
+            with open(tgzfile, "rb") as fstream:
+                names = extract_tarball_members(fstream, taskdir, is_needed_artifact_member)
+        _check_found_logs(names, tgzfile)
 
-    def _try_wget(tgz_path, url):
-        subprocess.run(["wget", "-O", tgz_path, url], stdout=subprocess.PIPE, check=True)
+    def _try_stream_extract(url):
+        # Extract into a scratch directory first, so that a WorkloadOutput
+        # directory only appears once every needed member is on disk.
+        scratch = os.path.join(dirpath, "dsi_artifact.part")
+        shutil.rmtree(scratch, ignore_errors=True)
+        try:
+            extracted = stream_extract_tarball(session, url, scratch, is_needed_artifact_member)
+        except Exception:
+            print(f"Failed to download artifact from {url}")
+            shutil.rmtree(scratch, ignore_errors=True)
+            raise
+        if not extracted:
+            shutil.rmtree(scratch, ignore_errors=True)
+        _check_found_logs(extracted, url)
+        print(f"Extracted {len(extracted)} files from {url}")
+        os.replace(os.path.join(scratch, "WorkloadOutput"), wld_output_path)
+        shutil.rmtree(scratch)
 
     if task_execution.status != "success":
         print(f"Skipping {dirpath} because the task execution failed.")
         return
 
+    session = make_session(1)
     for artifact in task_execution.artifacts:
         if "DSI Artifacts" not in artifact.name:
             continue
         tgz_path = os.path.join(dirpath, "dsi_artifact.tgz")
         wld_output_path = os.path.join(dirpath, "WorkloadOutput")
+        summary_csv_path = os.path.join(dirpath, YCSB_SUMMARY_STATS_CSV_FILENAME)
         if os.path.exists(tgz_path):
             print(f"Artifact at {tgz_path} already exists. Skipping download.")
-            _try_untar(dirpath)
+            _try_untar(dirpath, artifact.url)
         elif os.path.exists(wld_output_path):
             print(f"{wld_output_path} already exists. Skipping download.")
+        elif mode == "parse" and os.path.exists(summary_csv_path):
+            print(f"{summary_csv_path} already exists. Skipping download.")
+        elif mode == "streaming":
+            setup_output_dir(workload, task_execution)
+            print(f"Streaming: {artifact.url} to {wld_output_path}")
+            _try_stream_extract(artifact.url)
+        elif mode == "parse":
+            setup_output_dir(workload, task_execution)
+            print(f"Streaming: {artifact.url} to {dirpath}")
+            _parse_dsi_artifact(dirpath, task_execution, artifact.url)
         else:
             setup_output_dir(workload, task_execution)
             print(f"Downloading: {artifact.url} to {dirpath}/dsi_artifact.tgz")
             try:
-                _try_wget(tgz_path, artifact.url)
-            except:
+                download_to_file(session, artifact.url, tgz_path)
+            except Exception:
+                # A partial download is kept as dsi_artifact.tgz.part and
+                # resumed by the next run
                 print(f"Failed to download artifact from {artifact.url}")
-                if os.path.exists(tgz_path):
-                    os.remove(tgz_path)
                 raise
-            _try_untar(dirpath)
+            _try_untar(dirpath, artifact.url)
             os.remove(tgz_path)
         return
 
-def update_ycsb_summary_stats_csv(workload, task_execution, force_update=False):
+def _record_stats_csv(dirpath, filename, inputs, version, manifest_record):
+    if manifest_record is not None:
+        save_record(dirpath, filename, manifest_record)
+    else:
+        record_output(dirpath, filename, inputs, version)
+
+def update_ycsb_summary_stats_csv(workload, task_execution, force_update=False, manifest_record=None):
     dirpath = get_output_dir(workload, task_execution)
     csvpath = os.path.join(dirpath, YCSB_SUMMARY_STATS_CSV_FILENAME)
     reportsdir = os.path.join(dirpath, "WorkloadOutput", "reports")
@@ -86,34 +321,14 @@ def update_ycsb_summary_stats_csv(workload, task_execution, force_update=False):
 
     print(f"Updating {csvpath}")
 
-    csv_table = {hdr: [] for hdr in SUMMARY_STATS_HEADERS}
-    metrics_regex="(Operations|RunTime\\(ms\\)|Throughput\\(ops\\/sec\\)|(Average|Min|Max|95thPercentile|99thPercentile)Latency\\(us\\))"
-    regex=f"\\[(OVERALL|INSERT|READ|UPDATE)\\], {metrics_regex}, [0-9.]+"
-
+    phase_stats = {}
     for dir in YCSB_DIRS:
-        csv_row={hdr: None for hdr in SUMMARY_STATS_HEADERS}
-        csv_row["Patch ID"] = task_execution.version_id
-        csv_row["Execution"] = task_execution.execution
-        csv_row["Task Name"] = task_execution.display_name
-        csv_row["Topology"] = task_execution.build_variant
-        csv_row["Test"] = dir
-        logpath = os.path.join(reportsdir, dir, "test_output.log")
-
-        with subprocess.Popen(["egrep", "-o", regex, logpath], stdout=subprocess.PIPE, universal_newlines=True) as egrep:
-            for line in egrep.stdout:
-                # Each line is a 3-column CSV: (eg. "[OVERALL], Operations, 100000")
-                cols = [x.strip() for x in line.split(",")]
-
-                # Combine column 0 & 1 values to a metric key (e.g "Overall Operations")
-                key = cols[0][1] + cols[0][2:len(cols[0])-1].lower() + " " + cols[1]
-                csv_row[key] = cols[2]
-        for key, value in csv_row.items():
-            csv_table[key].append(value)
+        scanned = scan_ycsb_log_file(os.path.join(dirpath, summary_stats_log_path(dir)))
+        phase_stats[dir] = scanned[0] if scanned else {}
 
-    with open(csvpath, "w") as fstream:
-        with redirect_stdout(fstream):
-            print(",".join(SUMMARY_STATS_HEADERS))
-            print_csv(csv_table, SUMMARY_STATS_HEADERS)
+    _write_summary_stats_csv(csvpath, task_execution, phase_stats)
+    _record_stats_csv(dirpath, YCSB_SUMMARY_STATS_CSV_FILENAME, summary_stats_inputs(), SUMMARY_STATS_VERSION,
+        manifest_record)
 
 def force_update_ycsb_summary_stats_csv(workload, task_execution):
     update_ycsb_summary_stats_csv(workload, task_execution, True)
@@ -129,18 +344,11 @@ def print_ycsb_summary_stats_csv(workload, task_execution, include_headers=False
         for k in fstream:
             print(k.strip())
 
-def _grep_writeconflict_count(logpath):
-    regex = "WriteConflict.*Please retry your operation"
-    if not os.path.isfile(logpath):
-        return None
-    with subprocess.Popen(["egrep", "-c", regex, logpath], stdout=subprocess.PIPE, universal_newlines=True) as grep:
-        for line in grep.stdout:
-            try:
-                return int(line.strip())
-            except:
-                return None
+def _count_writeconflicts(logpath):
+    scanned = scan_ycsb_log_file(logpath)
+    return scanned[1] if scanned else None
 
-def update_ycsb_wc_stats_csv(workload, task_execution, force_update=False):
+def update_ycsb_wc_stats_csv(workload, task_execution, force_update=False, manifest_record=None):
     dirpath = get_output_dir(workload, task_execution)
     csvpath = os.path.join(dirpath, YCSB_WC_STATS_CSV_FILENAME)
     reportsdir = os.path.join(dirpath, "WorkloadOutput", "reports")
@@ -153,33 +361,20 @@ def update_ycsb_wc_stats_csv(workload, task_execution, force_update=False):
     if task_execution.status != "success":
         print(f"Skipping {dirpath} because the task execution failed.")
         return
+    inputs = wc_stats_inputs(task_execution)
+    missing = [path for path in inputs if not os.path.isfile(os.path.join(dirpath, path))]
+    if missing:
+        print(f"Skipping {csvpath} because of missing logs: {', '.join(missing)}")
+        return
 
     print(f"Updating {csvpath}")
 
-    csv_table = {hdr: [] for hdr in WC_STATS_HEADERS}
-
-    for phase in YCSB_DIRS:
-        logpath = os.path.join(reportsdir, phase, "mongod.0", "mongod.log")
-        count = _grep_writeconflict_count(logpath)
-        if count is None:
-            return
-        if sharded:
-            logpath = os.path.join(dirpath, "WorkloadOutput", "reports", phase, "mongod.2", "mongod.log")
-            s2_count = _grep_writeconflict_count(logpath)
-            if s2_count is None:
-                return
-            count += s2_count
-        csv_table[phase].append(str(count))
-
-    csv_table["Patch ID"].append(task_execution.version_id)
-    csv_table["Execution"].append(task_execution.execution)
-    csv_table["Task Name"].append(task_execution.display_name)
-    csv_table["Topology"].append(task_execution.build_variant)
-
-    with open(csvpath, "w") as fstream:
-        with redirect_stdout(fstream):
-            print(",".join(WC_STATS_HEADERS))
-            print_csv(csv_table, WC_STATS_HEADERS)
+    log_counts = {path: _count_writeconflicts(os.path.join(dirpath, path)) for path in inputs}
+    phase_counts = _sum_wc_counts(log_counts, sharded)
+    if phase_counts is None:
+        return
+    _write_wc_stats_csv(csvpath, task_execution, phase_counts)
+    _record_stats_csv(dirpath, YCSB_WC_STATS_CSV_FILENAME, inputs, WC_STATS_VERSION, manifest_record)
 
 def force_update_ycsb_wc_stats_csv(workload, task_execution):
     update_ycsb_wc_stats_csv(workload, task_execution, True)
@@ -194,3 +389,35 @@ def print_ycsb_wc_stats_csv(workload, task_execution, include_headers=False):
             fstream.readline()
         for k in fstream:
             print(k.strip())
+
+def _update_stale_parsed_stats_csvs(dirpath, task_execution):
+    # The CSVs that artifact_extraction: parse wrote have no logs on disk to
+    # check: they are stale once the stats code or the artifact's URL
+    # changes, and are then parsed out of the artifact again
+    url = _dsi_artifact_url(task_execution)
+    if url is None:
+        return
+    outputs = [(YCSB_SUMMARY_STATS_CSV_FILENAME, SUMMARY_STATS_VERSION), (YCSB_WC_STATS_CSV_FILENAME, WC_STATS_VERSION)]
+    stale = [x for x, version in outputs
+        if os.path.isfile(os.path.join(dirpath, x)) and get_stale_record(dirpath, x, [], version, url) is not None]
+    if stale:
+        print(f"{', '.join(stale)} in {dirpath} are stale; parsing {url} again")
+        _parse_dsi_artifact(dirpath, task_execution, url)
+
+def update_stale_ycsb_stats_csvs(workload, task_execution):
+    # Rebuilds the stats CSVs whose logs or stats code changed since they
+    # were written, according to the execution directory's manifest
+    dirpath = get_output_dir(workload, task_execution)
+    if not os.path.isdir(os.path.join(dirpath, "WorkloadOutput", "reports")):
+        _update_stale_parsed_stats_csvs(dirpath, task_execution)
+        return
+    record = get_stale_record(dirpath, YCSB_SUMMARY_STATS_CSV_FILENAME, summary_stats_inputs(),
+        SUMMARY_STATS_VERSION)
+    if record is not None:
+        update_ycsb_summary_stats_csv(workload, task_execution, True, record)
+    if task_execution.status != "success":
+        return
+    record = get_stale_record(dirpath, YCSB_WC_STATS_CSV_FILENAME, wc_stats_inputs(task_execution),
+        WC_STATS_VERSION)
+    if record is not None:
+        update_ycsb_wc_stats_csv(workload, task_execution, True, record)